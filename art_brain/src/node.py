@@ -13,10 +13,10 @@ from std_msgs.msg import Bool
 from art_msgs.msg import UserStatus, UserActivity, InterfaceState, SystemState, InstancesArray, \
     LearningRequestAction, LearningRequestGoal, LearningRequestResult
 from shape_msgs.msg import SolidPrimitive
-from art_msgs.srv import getObjectType, ProgramErrorResolveRequest, ProgramErrorResolveResponse, ProgramErrorResolve
+from art_msgs.srv import ProgramErrorResolveRequest, ProgramErrorResolveResponse, ProgramErrorResolve
 import numpy as np
 from art_helpers import InterfaceStateManager, ProgramHelper, ArtRobotHelper, \
-    UnknownRobot, RobotParametersNotOnParameterServer, InstructionsHelper, InstructionsHelperException
+    UnknownRobot, RobotParametersNotOnParameterServer, InstructionsHelper, InstructionsHelperException, ArtDbHelper
 from art_utils import ArtApiHelper
 
 from tf import TransformListener
@@ -210,8 +210,8 @@ class ArtBrain(object):
         self.tf_listener = TransformListener()
         self.art.wait_for_api()
 
-        self.get_obj_type_srv_client = ArtBrainUtils.create_service_client(
-            '/art/db/object_type/get', getObjectType)
+        self.db = ArtDbHelper()
+        self.db.wait_for_db_api()
         # self.select_arm_srv_client = ArtBrainUtils.create_service_client(
         #    '/art/fuzzy/select_arm', SelectArm)
         self.clear_all_object_flags_srv_client = ArtBrainUtils.create_service_client(
@@ -682,13 +682,16 @@ class ArtBrain(object):
             return True
 
     def check_place_pose(self, place_pose, obj):
-        w1 = self.get_object_max_width(obj)
+        # types of all objects are fetched at once
+        object_types = self.db.get_object_types([o.object_type for o in self.objects.instances] +
+                                                [obj.object_type]) or {}
+        w1 = self.get_object_max_width(obj, object_types)
         if w1 is None:
             return False
         for o in self.objects.instances:
             if o.object_id == obj.object_id:
                 continue
-            w2 = self.get_object_max_width(o)
+            w2 = self.get_object_max_width(o, object_types)
             if w2 is None:
                 # TODO: how to deal with this
                 return False
@@ -975,25 +978,23 @@ class ArtBrain(object):
     def system_calibrated_cb(self, req):
         self.system_calibrated = req.data
 
-    def get_object_max_width(self, obj):
+    def get_object_max_width(self, obj, object_types=None):
         if obj is None:
             rospy.logerr('No object is specified')
             return None
-        try:
-            obj_type = self.get_obj_type_srv_client.call(obj.object_type)
-            if not obj_type.success:
-                rospy.logerr('No object with id ' +
-                             str(obj.object_id) + ' found')
-                return None
-            if obj_type.object_type.bbox.type != SolidPrimitive.BOX:
-                rospy.logerr(
-                    'Sorry, only BOX type objects are supported at the moment')
-            x = obj_type.object_type.bbox.dimensions[SolidPrimitive.BOX_X]
-            y = obj_type.object_type.bbox.dimensions[SolidPrimitive.BOX_Y]
-            return np.hypot(x / 2, y / 2)
-        except rospy.ServiceException as e:
-            rospy.logerr('Service call failed: ' + str(e))
+        if object_types is None:
+            object_types = self.db.get_object_types([obj.object_type]) or {}
+        if obj.object_type not in object_types:
+            rospy.logerr('No object with id ' +
+                         str(obj.object_id) + ' found')
             return None
+        obj_type = object_types[obj.object_type]
+        if obj_type.bbox.type != SolidPrimitive.BOX:
+            rospy.logerr(
+                'Sorry, only BOX type objects are supported at the moment')
+        x = obj_type.bbox.dimensions[SolidPrimitive.BOX_X]
+        y = obj_type.bbox.dimensions[SolidPrimitive.BOX_Y]
+        return np.hypot(x / 2, y / 2)
 
     def learning_request_cb(self, goal):
         result = LearningRequestResult()
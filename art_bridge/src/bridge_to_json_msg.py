@@ -3,7 +3,7 @@ import rospy
 import jsonpickle
 from art_msgs.msg import InstancesArray
 from std_msgs.msg import String
-from art_msgs.srv import getObjectTypeRequest, getObjectType
+from art_db.srv import getObjectTypes
 
 
 class BridgeToJsonMsg:
@@ -11,10 +11,10 @@ class BridgeToJsonMsg:
     def __init__(self):
         rospy.Subscriber("/art/object_detector/object_filtered", InstancesArray, self.callback)
         self.pub = rospy.Publisher("/objects_string", String, queue_size=1)
-        rospy.loginfo("Waiting for /art/db/object_type/get service")
-        rospy.wait_for_service("/art/db/object_type/get")
-        rospy.loginfo("Service /art/db/object_type/get found")
-        self.get_object_type_srv = rospy.ServiceProxy("/art/db/object_type/get", getObjectType)
+        rospy.loginfo("Waiting for /art/db/object_types/get service")
+        rospy.wait_for_service("/art/db/object_types/get")
+        rospy.loginfo("Service /art/db/object_types/get found")
+        self.get_object_types_srv = rospy.ServiceProxy("/art/db/object_types/get", getObjectTypes)
         rospy.spin()
 
     def callback(self, detected_object):
@@ -23,6 +23,18 @@ class BridgeToJsonMsg:
         :return:
         """
 
+        try:
+            resp = self.get_object_types_srv.call(names=list(set(obj.object_type for obj in detected_object.instances)))
+        except rospy.ServiceException as e:
+            rospy.logerr("Service call failed: " + str(e))
+            return
+
+        if not resp.success:
+            rospy.logerr("Failed to get object types, skipping")
+            return
+
+        object_types = {object_type.name: object_type for object_type in resp.object_types}
+
         objects = []
         for obj in detected_object.instances:
             '''to_json = {'name': obj.object_id, 'pose': {'position': {'x': obj.pose.position.x,
@@ -32,12 +44,10 @@ class BridgeToJsonMsg:
                                                                             'y': obj.pose.orientation.y,
                                                                             'z': obj.pose.orientation.z,
                                                                             'w': obj.pose.orientation.w}}}'''
-            req = getObjectTypeRequest()
-            req.name = obj.object_type
-            resp = self.get_object_type_srv.call(req)
-            if not resp.success:
-                rospy.logwarn("Object type " + str(req.name) + " not in DB, skipping")
+            if obj.object_type not in object_types:
+                rospy.logwarn("Object type " + str(obj.object_type) + " not in DB, skipping")
                 continue
+            bbox = object_types[obj.object_type].bbox
             # TODO publikuje se automaticky Z poloha na 0.023 .. opravit
             to_json = {'name': obj.object_id,
                        'type': obj.object_type,
@@ -48,9 +58,9 @@ class BridgeToJsonMsg:
                                        'y': obj.pose.orientation.y,
                                        'z': obj.pose.orientation.z,
                                        'w': obj.pose.orientation.w},
-                       'bbox': {'x': resp.object_type.bbox.dimensions[0],
-                                'y': resp.object_type.bbox.dimensions[1],
-                                'z': resp.object_type.bbox.dimensions[2]}}
+                       'bbox': {'x': bbox.dimensions[0],
+                                'y': bbox.dimensions[1],
+                                'z': bbox.dimensions[2]}}
             objects.append(to_json)
         self.pub.publish(jsonpickle.encode(objects))
 
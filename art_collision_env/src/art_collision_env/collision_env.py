@@ -1,6 +1,7 @@
 import rospy
 from moveit_commander import PlanningSceneInterface
 from art_utils import ObjectHelper, ArtApiHelper, ArtApiException
+from art_helpers import ArtDbHelper
 from geometry_msgs.msg import PoseStamped
 from std_msgs.msg import Bool
 from art_msgs.msg import CollisionObjects
@@ -40,6 +41,8 @@ class CollisionEnv(object):
         self.api = ArtApiHelper()
         rospy.loginfo("Waiting for DB API")
         self.api.wait_for_db_api()
+        self.db = ArtDbHelper()
+        self.db.wait_for_db_api()
         self.ignored_prefixes = array_from_param("~ignored_prefixes")
 
         rospy.loginfo("Will ignore following prefixes: " + str(self.ignored_prefixes))
@@ -86,9 +89,8 @@ class CollisionEnv(object):
 
         with self.lock:
 
-            for name in self.artificial_objects.keys():
-
-                self.save_primitive(name)
+            if not self.db.add_collision_primitives(self.artificial_objects.values()):
+                rospy.logwarn("Failed to save artificial objects")
 
     def set_primitive_pose(self, name, ps):
 
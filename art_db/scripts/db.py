@@ -0,0 +1,707 @@
+#!/usr/bin/env python
+
+from art_msgs.msg import Program, ObjectType, CollisionPrimitive
+from art_msgs.srv import getProgram, getProgramResponse, getProgramHeaders, getProgramHeadersResponse, \
+    storeProgram, storeProgramResponse, getObjectType, getObjectTypeResponse, storeObjectType, storeObjectTypeResponse,\
+    ProgramIdTrigger, ProgramIdTriggerResponse, GetCollisionPrimitives, GetCollisionPrimitivesResponse,\
+    AddCollisionPrimitive, AddCollisionPrimitiveResponse, ClearCollisionPrimitives, ClearCollisionPrimitivesResponse
+from art_db.srv import getObjectTypes, getObjectTypesResponse, AddCollisionPrimitives, AddCollisionPrimitivesResponse
+import sys
+import rospy
+from art_helpers import ProgramHelper
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
+import os
+import rospkg
+
+from art_db.storage import StorageException, MongoStorage, SqliteStorage
+
+
+class MessageCache(object):
+
+    """Bounded in-memory cache of messages stored in the DB, keyed by their DB names.
+
+        Least recently used entries are evicted when the cache is full. Cached messages are shared with callers,
+        so they must not be modified in place.
+
+    """
+
+    def __init__(self, size):
+
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+
+        with self._lock:
+
+            try:
+                msg = self._items.pop(name)
+            except KeyError:
+                return None
+
+            self._items[name] = msg
+            return msg
+
+    def put(self, name, msg):
+
+        with self._lock:
+
+            self._items.pop(name, None)
+            self._items[name] = msg
+
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, name):
+
+        with self._lock:
+            self._items.pop(name, None)
+
+
+class ReadWriteLock(object):
+
+    """Lock which can be held either by any number of readers or by one writer.
+
+        Writers are preferred - new readers wait while there is a writer waiting. The lock is not reentrant.
+
+    """
+
+    def __init__(self):
+
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+
+        with self._cond:
+
+            while self._writer or self._writers_waiting > 0:
+                self._cond.wait()
+
+            self._readers += 1
+
+    def release_read(self):
+
+        with self._cond:
+
+            self._readers -= 1
+
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+
+        with self._cond:
+
+            self._writers_waiting += 1
+
+            while self._writer or self._readers > 0:
+                self._cond.wait()
+
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+
+        with self._cond:
+
+            self._writer = False
+            self._cond.notify_all()
+
+
+class KeyLocks(object):
+
+    """Creates (on demand) ReadWriteLock for each key, it is kept only while someone uses it.
+
+        Each get has to be paired with put (locks are counted, so that unused ones are dropped).
+
+    """
+
+    def __init__(self):
+
+        self._locks = {}  # key -> [ReadWriteLock, number of users]
+        self._lock = threading.Lock()
+
+    def get(self, key):
+
+        with self._lock:
+
+            if key not in self._locks:
+                self._locks[key] = [ReadWriteLock(), 0]
+
+            entry = self._locks[key]
+            entry[1] += 1
+
+            return entry[0]
+
+    def put(self, key):
+
+        with self._lock:
+
+            entry = self._locks[key]
+            entry[1] -= 1
+
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+class ArtDB:
+
+    def __init__(self):
+
+        storage = rospy.get_param("~storage", "mongodb")
+
+        if storage == "mongodb":
+
+            self.db = MongoStorage(rospy.get_param("mongodb_host"), rospy.get_param("mongodb_port"))
+
+        elif storage == "sqlite":
+
+            path = rospy.get_param("~sqlite_path",
+                                   os.path.join(rospkg.RosPack().get_path("art_db"), "db", "art_db.sqlite"))
+            self.db = SqliteStorage(path)
+            rospy.loginfo("Using SQLite storage: " + path)
+
+        else:
+
+            raise ValueError("Unknown storage: " + storage)
+
+        # reads of the same program / object type run concurrently, writes to it are exclusive
+        # operations holding the global lock for writing (e.g. readonly changes) exclude all other operations
+        self.global_lock = ReadWriteLock()
+        self.key_locks = KeyLocks()
+
+        self.cache = MessageCache(rospy.get_param("~cache_size", 100))
+
+        # program id -> ProgramHeader, loaded lazily (without program bodies) and then kept up to date
+        self.program_headers = None
+        self.program_headers_lock = threading.Lock()
+
+        self.srv_get_program = rospy.Service('/art/db/program/get', getProgram, self.srv_get_program_cb)
+        self.srv_get_program_headers = rospy.Service('/art/db/program_headers/get',
+                                                     getProgramHeaders,
+                                                     self.srv_get_program_headers_cb)
+
+        self.srv_store_program = rospy.Service('/art/db/program/store', storeProgram, self.srv_store_program_cb)
+        self.srv_delete_program = rospy.Service('/art/db/program/delete', ProgramIdTrigger, self.srv_delete_program_cb)
+        self.srv_ro_set_program = rospy.Service('/art/db/program/readonly/set',
+                                                ProgramIdTrigger,
+                                                self.srv_ro_set_program_cb)
+        self.srv_ro_clear_program = rospy.Service('/art/db/program/readonly/clear', ProgramIdTrigger,
+                                                  self.srv_ro_clear_program_cb)
+
+        self.srv_get_object = rospy.Service('/art/db/object_type/get', getObjectType, self.srv_get_object_cb)
+        self.srv_get_objects = rospy.Service('/art/db/object_types/get', getObjectTypes, self.srv_get_objects_cb)
+        self.srv_store_object = rospy.Service('/art/db/object_type/store', storeObjectType, self.srv_store_object_cb)
+
+        # clients caching object types are notified about every change
+        self.object_type_stored_pub = rospy.Publisher('/art/db/object_type/stored', ObjectType, queue_size=10)
+
+        self.srv_get_collision_primitives = rospy.Service('/art/db/collision_primitives/get', GetCollisionPrimitives,
+                                                          self.srv_get_collision_primitives_cb)
+        self.srv_add_collision_primitive = rospy.Service('/art/db/collision_primitives/add', AddCollisionPrimitive,
+                                                         self.srv_add_collision_primitive_cb)
+        self.srv_add_collision_primitives = rospy.Service('/art/db/collision_primitives/add_many',
+                                                          AddCollisionPrimitives,
+                                                          self.srv_add_collision_primitives_cb)
+        self.srv_clear_collision_primitive = rospy.Service('/art/db/collision_primitives/clear',
+                                                           ClearCollisionPrimitives,
+                                                           self.srv_clear_collision_primitives_cb)
+
+        rospy.loginfo('art_db ready')
+
+    @contextmanager
+    def _reading(self, *names):
+        """Shared access to messages with given names (locks are taken in sorted order to avoid deadlocks)."""
+
+        names = sorted(set(names))
+        locks = [self.key_locks.get(name) for name in names]
+        acquired = []
+
+        self.global_lock.acquire_read()
+
+        try:
+
+            for lock in locks:
+                lock.acquire_read()
+                acquired.append(lock)
+
+            yield
+
+        finally:
+
+            for lock in reversed(acquired):
+                lock.release_read()
+
+            for name in names:
+                self.key_locks.put(name)
+
+            self.global_lock.release_read()
+
+    @contextmanager
+    def _writing(self, name):
+        """Exclusive access to message with given name."""
+
+        lock = self.key_locks.get(name)
+
+        self.global_lock.acquire_read()
+
+        try:
+
+            lock.acquire_write()
+
+            try:
+                yield
+            finally:
+                lock.release_write()
+
+        finally:
+
+            self.key_locks.put(name)
+            self.global_lock.release_read()
+
+    @contextmanager
+    def _writing_all(self):
+        """Exclusive access to the whole DB."""
+
+        self.global_lock.acquire_write()
+
+        try:
+            yield
+        finally:
+            self.global_lock.release_write()
+
+    @staticmethod
+    def _collision_primitives_query(setup, names):
+
+        fields = {"setup": setup}
+
+        if names:
+            fields["name"] = names
+
+        return fields
+
+    @staticmethod
+    def _valid_names(names):
+
+        valid = [name for name in names if name != ""]
+
+        if len(valid) != len(names):
+            rospy.logwarn("Ignoring empty name.")
+
+        return valid
+
+    def srv_clear_collision_primitives_cb(self, req):
+
+        resp = ClearCollisionPrimitivesResponse(success=False)
+
+        names = self._valid_names(req.names)
+
+        if req.names and not names:
+            resp.success = True
+            return resp
+
+        # if no name is given, remove all primitives of given setup (of all setups if setup is not given)
+        fields = self._collision_primitives_query(req.setup, names)
+
+        if not names and not req.setup:
+            del fields["setup"]
+
+        try:
+            removed = self.db.delete_matching(CollisionPrimitive, fields)
+        except StorageException as e:
+
+            rospy.logerr("Failed to remove collision primitives: " + str(e))
+            return resp
+
+        rospy.loginfo("Removed " + str(removed) + " collision primitives.")
+
+        if names and removed < len(set(names)):
+            rospy.logwarn("Some of primitive names are unknown: " + str(names))
+
+        resp.success = True
+        return resp
+
+    @staticmethod
+    def _collision_primitive_name(primitive):
+        """Returns name of the primitive in the storage or None if the primitive can't be stored."""
+
+        if primitive.name == "":
+            rospy.logerr("Empty primitive name!")
+            return None
+
+        if primitive.setup == "":
+            rospy.logerr("Empty setup name!")
+            return None
+
+        return "collision_primitive_" + primitive.name + "_" + primitive.setup
+
+    def _store_collision_primitives(self, primitives):
+
+        items = [(self._collision_primitive_name(primitive), primitive) for primitive in primitives]
+        valid = [item for item in items if item[0] is not None]
+
+        try:
+            success = self.db.store_many(valid) if valid else True
+        except StorageException as e:
+            rospy.logerr("Failed to store collision primitives: " + str(e))
+            return False
+
+        return success and len(valid) == len(items)
+
+    def srv_add_collision_primitive_cb(self, req):
+
+        return AddCollisionPrimitiveResponse(success=self._store_collision_primitives([req.primitive]))
+
+    def srv_add_collision_primitives_cb(self, req):
+
+        # valid primitives are stored (upserted) at once, success is False if any of them is not valid
+        return AddCollisionPrimitivesResponse(success=self._store_collision_primitives(req.primitives))
+
+    def srv_get_collision_primitives_cb(self, req):
+
+        resp = GetCollisionPrimitivesResponse()
+
+        names = self._valid_names(req.names)
+
+        if req.names and not names:
+            return resp
+
+        # one query for all requested primitives (or for all of them if no name is given)
+        try:
+            primitives = self.db.query(CollisionPrimitive, self._collision_primitives_query(req.setup, names))
+        except StorageException as e:
+            rospy.logerr("Failed to get collision primitives: " + str(e))
+            return resp
+
+        if not names:
+
+            resp.primitives = primitives
+            return resp
+
+        found = {prim.name: prim for prim in primitives}
+
+        for name in names:
+
+            if name not in found:
+                rospy.logwarn("Unknown primitive name: " + name)
+                continue
+
+            resp.primitives.append(found[name])
+
+        return resp
+
+    def _query_named(self, name, msg_class):
+        """Returns message stored under given name (or None), answers from cache if possible."""
+
+        msg = self.cache.get(name)
+
+        if msg is None:
+
+            msg = self.db.get(name, msg_class)
+
+            if msg is not None:
+                self.cache.put(name, msg)
+
+        return msg
+
+    def _update_named(self, name, msg):
+
+        try:
+            success = self.db.store(name, msg)
+        except StorageException:
+            self.cache.invalidate(name)
+            raise
+
+        if success:
+            self.cache.put(name, msg)
+        else:
+            self.cache.invalidate(name)
+
+        return success
+
+    def _program_set_ro(self, program_id, ro):
+
+        with self._writing_all():
+
+            name = "program:" + str(program_id)
+            resp = ProgramIdTriggerResponse()
+            resp.success = False
+
+            try:
+                prog = self._query_named(name, Program)
+            except StorageException as e:
+                resp.error = str(e)
+                return resp
+
+            if not prog:
+                resp.error = "Program does not exist"
+                return resp
+
+            # cached message can't be modified in place
+            prog = deepcopy(prog)
+            prog.header.readonly = ro
+
+            try:
+                success = self._update_named(name, prog)
+            except StorageException as e:
+                resp.error = str(e)
+                return resp
+
+            if success:
+                self._set_program_header(prog.header)
+
+            resp.success = success
+            return resp
+
+    def srv_ro_set_program_cb(self, req):
+
+        return self._program_set_ro(req.program_id, True)
+
+    def srv_ro_clear_program_cb(self, req):
+
+        return self._program_set_ro(req.program_id, False)
+
+    def _load_program_headers(self):
+
+        # has to be called with program_headers_lock held
+        if self.program_headers is not None:
+            return
+
+        headers = OrderedDict()
+
+        # blocks are not needed at all, so let's not transfer and deserialize them
+        for prog in self.db.query(Program, exclude=["blocks"]):
+            headers[prog.header.id] = prog.header
+
+        rospy.loginfo("Loaded " + str(len(headers)) + " program headers.")
+        self.program_headers = headers
+
+    def _set_program_header(self, header):
+
+        with self.program_headers_lock:
+
+            if self.program_headers is not None:
+                self.program_headers[header.id] = header
+
+    def _delete_program_header(self, program_id):
+
+        with self.program_headers_lock:
+
+            if self.program_headers is not None:
+                self.program_headers.pop(program_id, None)
+
+    def srv_get_program_headers_cb(self, req):
+
+        with self._reading(), self.program_headers_lock:
+
+            resp = getProgramHeadersResponse()
+
+            try:
+                self._load_program_headers()
+            except StorageException as e:
+                print "Service call failed: " + str(e)
+                return resp
+
+            if len(req.ids) == 0:
+                resp.headers = list(self.program_headers.values())
+                return resp
+
+            for program_id in req.ids:
+                if program_id in self.program_headers:
+                    resp.headers.append(self.program_headers[program_id])
+
+            return resp
+
+    def srv_delete_program_cb(self, req):
+
+        name = "program:" + str(req.program_id)
+
+        with self._writing(name):
+
+            resp = ProgramIdTriggerResponse()
+            resp.success = False
+
+            # cached program may or may not be deleted if storage fails
+            self.cache.invalidate(name)
+
+            try:
+                resp.success = self.db.delete(name, Program)
+            except StorageException as e:
+                rospy.logerr("Failed to delete program: " + str(e))
+                resp.error = str(e)
+                return resp
+
+            if resp.success:
+                self._delete_program_header(req.program_id)
+
+            return resp
+
+    def srv_get_program_cb(self, req):
+
+        name = "program:" + str(req.id)
+
+        with self._reading(name):
+
+            resp = getProgramResponse()
+            resp.success = False
+
+            prog = None
+
+            try:
+                prog = self._query_named(name, Program)
+            except StorageException as e:
+                print "Service call failed: " + str(e)
+
+            if prog is not None:
+
+                resp.program = prog
+                resp.success = True
+
+            return resp
+
+    def srv_store_program_cb(self, req):
+
+        name = "program:" + str(req.program.header.id)
+
+        with self._writing(name):
+
+            resp = storeProgramResponse()
+            resp.success = False
+
+            try:
+                prog = self._query_named(name, Program)
+            except StorageException as e:
+                print "Service call failed: " + str(e)
+                return resp
+
+            if prog is not None and prog.header.readonly:
+                resp.error = "Readonly program."
+                return resp
+
+            ph = ProgramHelper()
+            if not ph.load(req.program):
+
+                resp.error = "Invalid program"
+                return resp
+
+            try:
+                success = self._update_named(name, req.program)
+            except StorageException as e:
+                print "Service call failed: " + str(e)
+                return resp
+
+            if success:
+                self._set_program_header(req.program.header)
+
+            resp.success = success
+            return resp
+
+    def srv_get_object_cb(self, req):
+
+        name = "object_type:" + str(req.name)
+
+        with self._reading(name):
+
+            resp = getObjectTypeResponse()
+            resp.success = False
+
+            try:
+                object_type = self._query_named(name, ObjectType)
+            except StorageException as e:
+                print "Service call failed: " + str(e)
+                return resp
+
+            if object_type:
+
+                resp.success = True
+                resp.object_type = object_type
+                return resp
+
+            rospy.logerr("Unknown object type: " + req.name)
+            return resp
+
+    def srv_get_objects_cb(self, req):
+
+        with self._reading(*["object_type:" + str(name) for name in req.names]):
+
+            resp = getObjectTypesResponse()
+            resp.success = False
+
+            object_types = OrderedDict.fromkeys(req.names)
+            missing = []
+
+            for name in object_types.keys():
+
+                object_types[name] = self.cache.get("object_type:" + str(name))
+
+                if object_types[name] is None:
+                    missing.append(name)
+
+            # all types which are not in cache are fetched at once
+            if missing:
+
+                try:
+                    found = self.db.get_many(["object_type:" + str(name) for name in missing], ObjectType)
+                except StorageException as e:
+                    print "Service call failed: " + str(e)
+                    return resp
+
+                for object_type in found.values():
+
+                    self.cache.put("object_type:" + str(object_type.name), object_type)
+                    object_types[object_type.name] = object_type
+
+            for name, object_type in object_types.iteritems():
+
+                if object_type is None:
+                    resp.unknown.append(name)
+                else:
+                    resp.object_types.append(object_type)
+
+            if resp.unknown:
+                rospy.logerr("Unknown object types: " + str(resp.unknown))
+
+            resp.success = True
+            return resp
+
+    def srv_store_object_cb(self, req):
+
+        name = "object_type:" + str(req.object_type.name)
+
+        with self._writing(name):
+
+            resp = storeObjectTypeResponse()
+
+            try:
+                success = self._update_named(name, req.object_type)
+            except StorageException as e:
+                print "Service call failed: " + str(e)
+                resp.success = False
+                return resp
+
+            if success:
+                self.object_type_stored_pub.publish(req.object_type)
+
+            resp.success = success
+            return resp
+
+
+def main(args):
+
+    rospy.init_node('art_db')
+    ArtDB()
+    rospy.spin()
+
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv)
+    except KeyboardInterrupt:
+        print("Shutting down")
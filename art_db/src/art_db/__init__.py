@@ -0,0 +1 @@
+from art_db.storage import Storage, StorageException, MongoStorage, SqliteStorage
@@ -0,0 +1,305 @@
+import sqlite3
+import threading
+from StringIO import StringIO
+
+
+class StorageException(Exception):
+
+    pass
+
+
+class Storage(object):
+
+    """Interface of art_db storage backends.
+
+        Each message is stored under unique name. Methods raise StorageException when the storage fails.
+
+    """
+
+    def get(self, name, msg_class):
+        """Returns message stored under given name or None."""
+
+        raise NotImplementedError
+
+    def get_many(self, names, msg_class):
+        """Returns dict (name -> message) of messages stored under given names (unknown names are left out)."""
+
+        raise NotImplementedError
+
+    def store(self, name, msg):
+        """Stores (inserts or replaces) message under given name. Returns True on success."""
+
+        raise NotImplementedError
+
+    def store_many(self, items):
+        """Stores (inserts or replaces) messages given as list of (name, message) at once. Returns True on success.
+
+            Backends without bulk upsert store them one by one (not atomically).
+
+        """
+
+        for name, msg in items:
+
+            if not self.store(name, msg):
+                return False
+
+        return True
+
+    def delete(self, name, msg_class):
+        """Deletes message stored under given name. Returns True if there was such message."""
+
+        raise NotImplementedError
+
+    def query(self, msg_class, fields=None, exclude=None):
+        """Returns list of messages of given type which match fields.
+
+            fields: dict (message field -> value or list of allowed values)
+            exclude: list of message fields which are not needed by the caller (they may be left empty)
+
+        """
+
+        raise NotImplementedError
+
+    def delete_matching(self, msg_class, fields=None):
+        """Deletes all messages of given type which match fields (see query). Returns number of deleted messages."""
+
+        raise NotImplementedError
+
+
+class MongoStorage(Storage):
+
+    """Storage based on mongodb_store (requires mongodb_store node running).
+
+        MessageStoreProxy has no bulk upsert, so store_many stores messages one by one.
+
+    """
+
+    def __init__(self, mongodb_host, mongodb_port):
+
+        # imported here so that other backends could be used without mongodb_store
+        from mongodb_store.message_store import MessageStoreProxy
+        from mongodb_store.util import import_MongoClient
+        from pymongo.errors import PyMongoError
+        import rospy
+
+        self.errors = (rospy.ServiceException, PyMongoError)
+
+        self.proxy = MessageStoreProxy()
+
+        # MessageStoreProxy can delete messages only one by one, bulk deletes are done directly
+        mongo_client = import_MongoClient()(mongodb_host, mongodb_port)
+        self.collection = mongo_client[self.proxy.database][self.proxy.collection]
+
+    @staticmethod
+    def _message_query(fields):
+
+        message_query = {}
+
+        for field, value in (fields or {}).iteritems():
+
+            if isinstance(value, (list, tuple)):
+                message_query[field] = {"$in": list(value)}
+            else:
+                message_query[field] = value
+
+        return message_query
+
+    def get(self, name, msg_class):
+
+        try:
+            return self.proxy.query_named(name, msg_class._type)[0]
+        except self.errors as e:
+            raise StorageException(str(e))
+
+    def get_many(self, names, msg_class):
+
+        try:
+            found = self.proxy.query(msg_class._type, meta_query={"name": {"$in": list(names)}})
+        except self.errors as e:
+            raise StorageException(str(e))
+
+        return {meta["name"]: msg for msg, meta in found}
+
+    def store(self, name, msg):
+
+        try:
+            return self.proxy.update_named(name, msg, upsert=True).success
+        except self.errors as e:
+            raise StorageException(str(e))
+
+    def delete(self, name, msg_class):
+
+        try:
+
+            meta = self.proxy.query_named(name, msg_class._type)[1]
+
+            if meta is None:
+                return False
+
+            return self.proxy.delete(str(meta["_id"]))
+
+        except self.errors as e:
+            raise StorageException(str(e))
+
+    def query(self, msg_class, fields=None, exclude=None):
+
+        projection_query = {field: 0 for field in (exclude or [])}
+
+        try:
+            found = self.proxy.query(msg_class._type, message_query=self._message_query(fields),
+                                     projection_query=projection_query)
+        except self.errors as e:
+            raise StorageException(str(e))
+
+        return [msg for msg, _ in found]
+
+    def delete_matching(self, msg_class, fields=None):
+
+        query = self._message_query(fields)
+        query["_meta.stored_type"] = msg_class._type
+
+        try:
+            return self.collection.remove(query)["n"]
+        except self.errors as e:
+            raise StorageException(str(e))
+
+
+class SqliteStorage(Storage):
+
+    """Embedded storage keeping serialized messages in SQLite database (file or ':memory:').
+
+        Queries by message fields deserialize all messages of given type, which is fine for tens or hundreds
+        of messages. Access to the database is serialized.
+
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.lock = threading.Lock()
+
+        try:
+
+            # connection is shared by all threads of the node, access is guarded by the lock
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS messages "
+                              "(name TEXT PRIMARY KEY, type TEXT NOT NULL, data BLOB NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS messages_type ON messages (type)")
+            self.conn.commit()
+
+        except sqlite3.Error as e:
+            raise StorageException(str(e))
+
+    @staticmethod
+    def _serialize(msg):
+
+        buff = StringIO()
+        msg.serialize(buff)
+        return sqlite3.Binary(buff.getvalue())
+
+    @staticmethod
+    def _deserialize(data, msg_class):
+
+        return msg_class().deserialize(str(data))
+
+    @staticmethod
+    def _matches(msg, fields):
+
+        for field, value in (fields or {}).iteritems():
+
+            if isinstance(value, (list, tuple)):
+                if getattr(msg, field) not in value:
+                    return False
+            elif getattr(msg, field) != value:
+                return False
+
+        return True
+
+    def _execute(self, sql, args=(), commit=False, many=False):
+
+        with self.lock:
+
+            try:
+
+                if many:
+                    cur = self.conn.executemany(sql, args)
+                else:
+                    cur = self.conn.execute(sql, args)
+
+                rows = cur.fetchall()
+
+                if commit:
+                    self.conn.commit()
+
+                return rows, cur.rowcount
+
+            except sqlite3.Error as e:
+
+                self.conn.rollback()
+                raise StorageException(str(e))
+
+    def get(self, name, msg_class):
+
+        rows, _ = self._execute("SELECT data FROM messages WHERE name = ? AND type = ?", (name, msg_class._type))
+
+        if not rows:
+            return None
+
+        return self._deserialize(rows[0][0], msg_class)
+
+    def get_many(self, names, msg_class):
+
+        names = list(names)
+
+        if not names:
+            return {}
+
+        rows, _ = self._execute("SELECT name, data FROM messages WHERE type = ? AND name IN (" +
+                                ", ".join("?" * len(names)) + ")", [msg_class._type] + names)
+
+        return {name: self._deserialize(data, msg_class) for name, data in rows}
+
+    def store(self, name, msg):
+
+        self._execute("INSERT OR REPLACE INTO messages (name, type, data) VALUES (?, ?, ?)",
+                      (name, msg._type, self._serialize(msg)), commit=True)
+        return True
+
+    def store_many(self, items):
+
+        # one transaction for all of them
+        self._execute("INSERT OR REPLACE INTO messages (name, type, data) VALUES (?, ?, ?)",
+                      [(name, msg._type, self._serialize(msg)) for name, msg in items], commit=True, many=True)
+        return True
+
+    def delete(self, name, msg_class):
+
+        _, count = self._execute("DELETE FROM messages WHERE name = ? AND type = ?", (name, msg_class._type),
+                                 commit=True)
+        return count > 0
+
+    def _query_rows(self, msg_class, fields):
+
+        rows, _ = self._execute("SELECT name, data FROM messages WHERE type = ?", (msg_class._type, ))
+
+        for name, data in rows:
+
+            msg = self._deserialize(data, msg_class)
+
+            if self._matches(msg, fields):
+                yield name, msg
+
+    def query(self, msg_class, fields=None, exclude=None):
+
+        return [msg for _, msg in self._query_rows(msg_class, fields)]
+
+    def delete_matching(self, msg_class, fields=None):
+
+        names = [name for name, _ in self._query_rows(msg_class, fields)]
+
+        if not names:
+            return 0
+
+        _, count = self._execute("DELETE FROM messages WHERE type = ? AND name IN (" +
+                                 ", ".join("?" * len(names)) + ")", [msg_class._type] + names, commit=True)
+        return count
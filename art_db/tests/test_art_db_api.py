@@ -6,8 +6,10 @@ import rospy
 import rostest
 from copy import deepcopy
 
-from art_msgs.msg import Program, ProgramBlock, ProgramItem, ObjectType
-from art_msgs.srv import getProgram, getProgramHeaders, storeProgram, getObjectType, storeObjectType
+from art_msgs.msg import Program, ProgramBlock, ProgramItem, ObjectType, CollisionPrimitive
+from art_db.srv import getObjectTypes, AddCollisionPrimitives
+from art_msgs.srv import getProgram, getProgramHeaders, storeProgram, getObjectType, storeObjectType, \
+    ProgramIdTrigger, GetCollisionPrimitives, ClearCollisionPrimitives
 from shape_msgs.msg import SolidPrimitive
 from geometry_msgs.msg import PoseStamped, PolygonStamped, Point32
 
@@ -23,9 +25,15 @@ class TestArtDb(unittest.TestCase):
 
         self.get_object_srv = rospy.ServiceProxy('/art/db/object_type/get', getObjectType)
         self.store_object_srv = rospy.ServiceProxy('/art/db/object_type/store', storeObjectType)
+        self.get_objects_srv = rospy.ServiceProxy('/art/db/object_types/get', getObjectTypes)
         self.store_program_srv = rospy.ServiceProxy('/art/db/program/store', storeProgram)
         self.get_program_srv = rospy.ServiceProxy('/art/db/program/get', getProgram)
         self.get_program_headers_srv = rospy.ServiceProxy('/art/db/program_headers/get', getProgramHeaders)
+        self.ro_set_program_srv = rospy.ServiceProxy('/art/db/program/readonly/set', ProgramIdTrigger)
+        self.ro_clear_program_srv = rospy.ServiceProxy('/art/db/program/readonly/clear', ProgramIdTrigger)
+        self.add_primitives_srv = rospy.ServiceProxy('/art/db/collision_primitives/add_many', AddCollisionPrimitives)
+        self.get_primitives_srv = rospy.ServiceProxy('/art/db/collision_primitives/get', GetCollisionPrimitives)
+        self.clear_primitives_srv = rospy.ServiceProxy('/art/db/collision_primitives/clear', ClearCollisionPrimitives)
 
     def test_object_type(self):
 
@@ -51,6 +59,23 @@ class TestArtDb(unittest.TestCase):
         self.assertEquals(resp_get.success, True, "object_type_get")
         self.assertEquals(resp_get.object_type.name, "profile_test_1", "object_type_get")
 
+    def test_object_types(self):
+
+        for name in ("profile_test_2", "profile_test_3"):
+
+            ot = ObjectType()
+            ot.name = name
+            ot.bbox.type = SolidPrimitive.BOX
+            ot.bbox.dimensions = [0.1, 0.1, 0.1]
+            self.assertEquals(self.store_object_srv(ot).success, True, "object_type_store")
+
+        resp_get = self.get_objects_srv(names=["profile_test_2", "profile_test_xy", "profile_test_3", "profile_test_2"])
+
+        self.assertEquals(resp_get.success, True, "object_types_get")
+        self.assertEquals([ot.name for ot in resp_get.object_types], ["profile_test_2", "profile_test_3"],
+                          "object_types_get_names")
+        self.assertEquals(resp_get.unknown, ["profile_test_xy"], "object_types_get_unknown")
+
     def test_invalid_object_type(self):
 
         try:
@@ -193,6 +218,80 @@ class TestArtDb(unittest.TestCase):
         self.assertEquals(len(resp_headers.headers), 1, "program_headers_len")
         self.assertEquals(resp_headers.headers[0].id, 999, "program_headers_id")
 
+    def test_program_readonly(self):
+
+        prog = Program()
+        prog.header.id = 998
+        prog.header.name = "Test readonly"
+
+        pb = ProgramBlock()
+        pb.id = 1
+        pb.on_success = 0
+        pb.on_failure = 0
+        prog.blocks.append(pb)
+
+        p = ProgramItem()
+        p.id = 1
+        p.on_success = 0
+        p.on_failure = 0
+        p.type = "GetReady"
+        pb.items.append(p)
+
+        self.assertEquals(self.store_program_srv(program=prog).success, True, "program_store")
+        self.assertEquals(self.ro_set_program_srv(program_id=998).success, True, "program_ro_set")
+
+        # readonly flag has to be visible in all read services
+        self.assertEquals(self.get_program_srv(id=998).program.header.readonly, True, "program_get_ro")
+        self.assertEquals(self.get_program_headers_srv(ids=[998]).headers[0].readonly, True, "program_headers_ro")
+        self.assertEquals(self.store_program_srv(program=prog).success, False, "program_store_ro")
+
+        self.assertEquals(self.ro_clear_program_srv(program_id=998).success, True, "program_ro_clear")
+        self.assertEquals(self.get_program_srv(id=998).program.header.readonly, False, "program_get_rw")
+        self.assertEquals(self.store_program_srv(program=prog).success, True, "program_store_rw")
+
+    def test_collision_primitives(self):
+
+        primitives = []
+
+        for name in ("box_1", "box_2", "box_3"):
+
+            cp = CollisionPrimitive()
+            cp.name = name
+            cp.setup = "test_setup"
+            cp.bbox.type = SolidPrimitive.BOX
+            cp.bbox.dimensions = [0.1, 0.1, 0.1]
+            cp.pose.header.frame_id = "marker"
+            cp.pose.pose.orientation.w = 1.0
+            primitives.append(cp)
+
+        self.assertEquals(self.add_primitives_srv(primitives=primitives).success, True, "primitives_add")
+        self.assertEquals(len(self.get_primitives_srv(setup="test_setup").primitives), 3, "primitives_get_all")
+
+        other = deepcopy(primitives[0])
+        other.setup = "other_setup"
+        invalid = deepcopy(primitives[0])
+        invalid.name = ""
+
+        # valid primitives are stored even if some are not
+        self.assertEquals(self.add_primitives_srv(primitives=[other, invalid]).success, False,
+                          "primitives_add_invalid")
+        self.assertEquals(len(self.get_primitives_srv(setup="other_setup").primitives), 1, "primitives_get_other")
+
+        resp_get = self.get_primitives_srv(setup="test_setup", names=["box_3", "box_x", "box_1"])
+        self.assertEquals([cp.name for cp in resp_get.primitives], ["box_3", "box_1"], "primitives_get_names")
+
+        self.assertEquals(self.clear_primitives_srv(setup="test_setup", names=["box_1"]).success, True,
+                          "primitives_clear_names")
+        self.assertEquals(len(self.get_primitives_srv(setup="test_setup").primitives), 2, "primitives_get_cleared")
+
+        self.assertEquals(self.clear_primitives_srv(setup="test_setup").success, True, "primitives_clear_all")
+        self.assertEquals(len(self.get_primitives_srv(setup="test_setup").primitives), 0, "primitives_get_empty")
+
+        # only primitives of the given setup are removed
+        self.assertEquals(len(self.get_primitives_srv(setup="other_setup").primitives), 1, "primitives_get_other_kept")
+        self.assertEquals(self.clear_primitives_srv().success, True, "primitives_clear_all_setups")
+        self.assertEquals(len(self.get_primitives_srv(setup="other_setup").primitives), 0, "primitives_get_other_empty")
+
     def test_invalid_program_get(self):
 
         try:
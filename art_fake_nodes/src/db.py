@@ -7,6 +7,7 @@ from art_msgs.srv import getProgram, getProgramResponse, getProgramHeaders, getP
     ProgramIdTrigger, ProgramIdTriggerResponse, GetCollisionPrimitives, GetCollisionPrimitivesResponse,\
     AddCollisionPrimitive, AddCollisionPrimitiveResponse, ClearCollisionPrimitives, ClearCollisionPrimitivesResponse
 
+from art_db.srv import getObjectTypes, getObjectTypesResponse
 from art_msgs.msg import Program, ProgramBlock, ProgramItem, ProgramHeader, ObjectType
 from geometry_msgs.msg import PoseStamped, PolygonStamped, Pose, Point, Quaternion, Polygon, Point32
 from shape_msgs.msg import SolidPrimitive
@@ -31,6 +32,7 @@ class FakeCalibration:
                                                   self.srv_ro_clear_program_cb)
 
         self.srv_get_object = rospy.Service('/art/db/object_type/get', getObjectType, self.srv_get_object_cb)
+        self.srv_get_objects = rospy.Service('/art/db/object_types/get', getObjectTypes, self.srv_get_objects_cb)
         self.srv_store_object = rospy.Service('/art/db/object_type/store', storeObjectType, self.srv_store_object_cb)
 
         self.srv_get_collision_primitives = rospy.Service('/art/db/collision_primitives/get', GetCollisionPrimitives,
@@ -121,12 +123,18 @@ class FakeCalibration:
     def srv_ro_clear_program_cb(self, request):
         return ProgramIdTriggerResponse(success=True)
 
+    @staticmethod
+    def fake_object_type(name):
+        return ObjectType(name=name,
+                          container=True,
+                          bbox=SolidPrimitive(type=1, dimensions=[0.1, 0.1, 0.1]))
+
     def srv_get_object_cb(self, request):
-        return getObjectTypeResponse(success=True,
-                                     object_type=ObjectType(
-                                         name=request.name,
-                                         container=True,
-                                         bbox=SolidPrimitive(type=1, dimensions=[0.1, 0.1, 0.1])))
+        return getObjectTypeResponse(success=True, object_type=self.fake_object_type(request.name))
+
+    def srv_get_objects_cb(self, request):
+        return getObjectTypesResponse(success=True,
+                                      object_types=[self.fake_object_type(name) for name in request.names])
 
     def srv_store_object_cb(self, request):
         return storeObjectTypeResponse(success=True)
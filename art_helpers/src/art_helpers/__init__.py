@@ -4,6 +4,7 @@ from art_helpers.art_robot_helper import ArtRobotArmHelper, ArtRobotHelper, Unkn
     RobotParametersNotOnParameterServer
 from art_helpers.interface_state_manager import InterfaceStateManager
 from art_helpers.calibration_helper import ArtCalibrationHelper
+from art_helpers.db_helper import ArtDbHelper
 
 import rospy
 
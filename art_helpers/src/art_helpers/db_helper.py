@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import rospy
+from art_db.srv import getObjectTypes, AddCollisionPrimitives
+
+
+class ArtDbHelper(object):
+
+    """ArtDbHelper provides access to batch services of art_db.
+
+        Use it instead of per-item calls (e.g. ArtApiHelper.get_object_type) when more items are needed at once,
+        as each call is a separate ROS service round trip.
+
+    """
+
+    def __init__(self):
+
+        self.get_object_types_srv = rospy.ServiceProxy('/art/db/object_types/get', getObjectTypes)
+        self.add_collision_primitives_srv = rospy.ServiceProxy('/art/db/collision_primitives/add_many',
+                                                               AddCollisionPrimitives)
+
+    def wait_for_db_api(self, timeout=None):
+
+        self.get_object_types_srv.wait_for_service(timeout)
+        self.add_collision_primitives_srv.wait_for_service(timeout)
+
+    def get_object_types(self, names):
+        """Returns dictionary (name -> ObjectType) of known object types from given names or None if the DB
+        could not be asked (so that missing names are not taken for unknown types)."""
+
+        names = list(set(names))
+
+        if not names:
+            return {}
+
+        try:
+            resp = self.get_object_types_srv(names=names)
+        except rospy.ServiceException as e:
+            rospy.logerr("Service call failed: " + str(e))
+            return None
+
+        if not resp.success:
+            return None
+
+        return {object_type.name: object_type for object_type in resp.object_types}
+
+    def add_collision_primitives(self, primitives):
+        """Stores (inserts or updates) all given collision primitives at once."""
+
+        if not primitives:
+            return True
+
+        try:
+            resp = self.add_collision_primitives_srv(primitives=primitives)
+        except rospy.ServiceException as e:
+            rospy.logerr("Service call failed: " + str(e))
+            return False
+
+        return resp.success
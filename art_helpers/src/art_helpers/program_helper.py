@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
 import rospy
+import hashlib
+import threading
+from collections import OrderedDict
+from StringIO import StringIO
 from art_msgs.msg import Program
 from geometry_msgs.msg import Pose, Polygon
 from art_helpers import InstructionsHelper
@@ -14,11 +18,22 @@ class ProgramHelper(object):
 
     """ProgramHelper simplifies work with Program message.
 
-        The class can load and check Program message. It has no internal state.
-        It only helps to find next block/item id after success or failure (without iterating over all blocks/items).
+        The class can load and check Program message.
+        It helps to find next block/item id after success or failure (without iterating over all blocks/items).
+
+        Results of validation are cached in class-level dictionaries (keyed by hash of serialized program / block),
+        which are shared by all instances (in one process), so loading of unchanged program is cheap and only
+        changed blocks are checked again after an edit.
 
     """
 
+    VALIDATION_CACHE_SIZE = 100
+
+    # hash -> validation result (False for invalid program / block)
+    _validated_programs = OrderedDict()
+    _validated_blocks = OrderedDict()
+    _validation_lock = threading.Lock()
+
     def __init__(self):
 
         self._cache = {}
@@ -26,12 +41,57 @@ class ProgramHelper(object):
 
         self.ih = InstructionsHelper()
 
+    @staticmethod
+    def _msg_hash(msg):
+
+        buff = StringIO()
+        msg.serialize(buff)
+        return hashlib.sha1(buff.getvalue()).hexdigest()
+
+    @classmethod
+    def _get_validated(cls, validated, msg_hash):
+
+        with cls._validation_lock:
+            return validated.get(msg_hash)
+
+    @classmethod
+    def _set_validated(cls, validated, msg_hash, result):
+
+        with cls._validation_lock:
+
+            validated[msg_hash] = result
+
+            while len(validated) > cls.VALIDATION_CACHE_SIZE:
+                validated.popitem(last=False)
+
     def load(self, prog, template=False):
 
         if not isinstance(prog, Program):
             rospy.logerr("Invalid argument. Should be Program message.")
             return False
 
+        prog_hash = self._msg_hash(prog)
+        cache = self._get_validated(self._validated_programs, prog_hash)
+
+        if cache is None:
+
+            cache = self._validate_program(prog)
+            self._set_validated(self._validated_programs, prog_hash, cache)
+
+        if cache is False:
+            return False
+
+        self._prog = prog
+        self._cache = cache
+
+        if template:
+            self._clear_template(prog)
+
+        return True
+
+    def _validate_program(self, prog):
+        """Returns cache (ids -> indexes etc.) for valid program, False otherwise."""
+
         cache = {}
 
         if len(prog.blocks) == 0:
@@ -53,149 +113,175 @@ class ProgramHelper(object):
                 rospy.logerr("Invalid block id: " + str(block.id))
                 return False
 
+            items = self._validate_block(block)
+
+            if items is False:
+                return False
+
             cache[block.id] = {}
 
             cache[block.id]["idx"] = block_idx
             cache[block.id]["on_success"] = block.on_success
             cache[block.id]["on_failure"] = block.on_failure
-            cache[block.id]["items"] = {}
+            cache[block.id]["items"] = items
+
+        for k, v in cache.iteritems():
 
-            if len(block.items) == 0:
+            # 0 means jump to the end
+            if v["on_success"] != 0 and v["on_success"] not in cache:
 
-                rospy.logerr("Block with zero items!")
+                rospy.logerr("Block id: " + str(k) + " has invalid on_success: " + str(v["on_success"]))
                 return False
 
-            for item_idx in range(0, len(block.items)):
+            if v["on_failure"] != 0 and v["on_failure"] not in cache:
 
-                item = block.items[item_idx]
+                rospy.logerr("Block id: " + str(k) + " has invalid on_failure: " + str(v["on_failure"]))
+                return False
 
-                if item.type not in self.ih.known_instructions():
+        return cache
 
-                    rospy.logerr("Unknown instruction: " + item.type)
-                    return False
+    def _validate_block(self, block):
+        """Returns cache of block items if the block is valid, False otherwise."""
 
-                if item.id in cache[block.id]["items"]:
+        block_hash = self._msg_hash(block)
+        items = self._get_validated(self._validated_blocks, block_hash)
 
-                    rospy.logerr("Duplicate item id: " + str(item.id) + " (block id: " + str(block.id) + ")")
-                    return False
+        if items is None:
 
-                if item.id == 0:
+            items = self._check_block(block)
+            self._set_validated(self._validated_blocks, block_hash, items)
 
-                    rospy.logerr("Invalid item id: " + str(item.id) + " (block id: " + str(block.id) + ")")
-                    return False
+        return items
 
-                cache[block.id]["items"][item.id] = {}
-                cache[block.id]["items"][item.id]["idx"] = item_idx
-                cache[block.id]["items"][item.id]["on_success"] = item.on_success
-                cache[block.id]["items"][item.id]["on_failure"] = item.on_failure
+    def _check_block(self, block):
 
-        self._prog = prog
-        self._cache = cache
+        items = {}
 
-        # now the cache is done, let's make some simple checks
-        for k, v in cache.iteritems():
+        if len(block.items) == 0:
 
-            # TODO refactor into separate method check_item
-            # 0 means jump to the end
-            if v["on_success"] != 0 and v["on_success"] not in cache:
+            rospy.logerr("Block with zero items!")
+            return False
 
-                rospy.logerr("Block id: " + str(k) + " has invalid on_success: " + str(v["on_success"]))
-                return False
+        for item_idx in range(0, len(block.items)):
 
-            if v["on_failure"] != 0 and v["on_failure"] not in cache:
+            item = block.items[item_idx]
 
-                rospy.logerr("Block id: " + str(k) + " has invalid on_success: " + str(v["on_success"]))
+            if item.type not in self.ih.known_instructions():
+
+                rospy.logerr("Unknown instruction: " + item.type)
                 return False
 
-            for kk, vv in v["items"].iteritems():
+            if item.id in items:
 
-                # 0 means jump to the end
-                if vv["on_success"] != 0 and vv["on_success"] not in cache[k]["items"]:
+                rospy.logerr("Duplicate item id: " + str(item.id) + " (block id: " + str(block.id) + ")")
+                return False
 
-                    rospy.logerr("Block id: " + str(k) + ", item id: " +
-                                 str(kk) + " has invalid on_success: " + str(vv["on_success"]))
-                    return False
+            if item.id == 0:
 
-                if vv["on_failure"] != 0 and vv["on_failure"] not in cache[k]["items"]:
+                rospy.logerr("Invalid item id: " + str(item.id) + " (block id: " + str(block.id) + ")")
+                return False
 
-                    rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) +
-                                 " has invalid on_failure: " + str(vv["on_failure"]))
-                    return False
+            items[item.id] = {}
+            items[item.id]["idx"] = item_idx
+            items[item.id]["on_success"] = item.on_success
+            items[item.id]["on_failure"] = item.on_failure
 
-                item = prog.blocks[v["idx"]].items[vv["idx"]]
+        # items may only refer to items of the same block, so the block is checked as a program on its own
+        prog, cache = self._prog, self._cache
 
-                # any reference should exist in the same block
-                for ref in item.ref_id:
+        self._prog = Program(blocks=[block])
+        self._cache = {block.id: {"idx": 0, "on_success": 0, "on_failure": 0, "items": items}}
 
-                    if ref not in cache[k]["items"]:
+        try:
+            valid = self._check_items(block.id)
+        finally:
+            self._prog, self._cache = prog, cache
 
-                        rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) +
-                                     " has invalid ref_id: " + str(ref))
-                        return False
+        return items if valid else False
 
-                # at least one 'object' mandatory for following types
-                if item.type in self.ih.properties.using_object:
+    def _check_items(self, k):
 
-                    res = self.get_object(k, kk)
+        for kk, vv in self._cache[k]["items"].iteritems():
 
-                    if res is None:
-                        rospy.logerr("No 'object' for block id: " + str(k) + ", item id: " + str(kk) + "!")
-                        return False
+            # 0 means jump to the end
+            if vv["on_success"] != 0 and vv["on_success"] not in self._cache[k]["items"]:
 
-                # at least one 'pose' mandatory for following types
-                if item.type in self.ih.properties.using_pose:
+                rospy.logerr("Block id: " + str(k) + ", item id: " +
+                             str(kk) + " has invalid on_success: " + str(vv["on_success"]))
+                return False
 
-                    res = self.get_pose(k, kk)
+            if vv["on_failure"] != 0 and vv["on_failure"] not in self._cache[k]["items"]:
 
-                    if res is None:
-                        rospy.logerr("No 'pose' for block id: " + str(k) + ", item id: " + str(kk) + "!")
-                        return False
+                rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) +
+                             " has invalid on_failure: " + str(vv["on_failure"]))
+                return False
 
-                # at least one 'polygon' mandatory for following types
-                if item.type in self.ih.properties.using_polygon:
+            item = self.get_item_msg(k, kk)
 
-                    res = self.get_polygon(k, kk)
+            # any reference should exist in the same block
+            for ref in item.ref_id:
 
-                    if res is None:
-                        rospy.logerr("No 'polygon' for block id: " + str(k) + ", item id: " + str(kk) + "!")
-                        return False
+                if ref not in self._cache[k]["items"]:
 
-                # check if PLACE_* instruction has correct ref_id(s) - should be set and point to PICK_*
-                if item.type in self.ih.properties.place | self.ih.properties.ref_to_pick:
+                    rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) +
+                                 " has invalid ref_id: " + str(ref))
+                    return False
 
-                    if len(item.ref_id) == 0:
+            # at least one 'object' / 'pose' / 'polygon' mandatory for following types
+            for what, using, get in (("object", self.ih.properties.using_object, self.get_object),
+                                     ("pose", self.ih.properties.using_pose, self.get_pose),
+                                     ("polygon", self.ih.properties.using_polygon, self.get_polygon)):
 
-                        rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) + " has NO ref_id!")
-                        return False
+                if item.type not in using:
+                    continue
 
-                    for ref_id in item.ref_id:
+                try:
+                    get(k, kk)
+                except ProgramHelperException:
+
+                    rospy.logerr("No '" + what + "' for block id: " + str(k) + ", item id: " + str(kk) + "!")
+                    return False
 
-                        ref_msg = self.get_item_msg(k, ref_id)
+            # check if PLACE_* instruction has correct ref_id(s) - should be set and point to PICK_*
+            if item.type in self.ih.properties.place | self.ih.properties.ref_to_pick:
 
-                        if ref_msg.type not in self.ih.properties.pick:
+                if len(item.ref_id) == 0:
 
-                            rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) +
-                                         " has ref_id which is not PICK_*!")
-                            return False
+                    rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) + " has NO ref_id!")
+                    return False
 
-                # TODO refactor into separate method
-                if template:
+                for ref_id in item.ref_id:
 
-                    if "object" not in item.do_not_clear:
-                        for i in range(0, len(item.object)):
-                            item.object[i] = ""
+                    ref_msg = self.get_item_msg(k, ref_id)
 
-                    # for stamped types we want to keep header (frame_id)
-                    if "polygon" not in item.do_not_clear:
-                        for polygon in item.polygon:
-                            polygon.polygon = Polygon()
+                    if ref_msg.type not in self.ih.properties.pick:
 
-                    if "pose" not in item.do_not_clear:
-                        for pose in item.pose:
-                            pose.pose = Pose()
+                        rospy.logerr("Block id: " + str(k) + ", item id: " + str(kk) +
+                                     " has ref_id which is not PICK_*!")
+                        return False
 
         return True
 
+    @staticmethod
+    def _clear_template(prog):
+
+        for block in prog.blocks:
+
+            for item in block.items:
+
+                if "object" not in item.do_not_clear:
+                    for i in range(0, len(item.object)):
+                        item.object[i] = ""
+
+                # for stamped types we want to keep header (frame_id)
+                if "polygon" not in item.do_not_clear:
+                    for polygon in item.polygon:
+                        polygon.polygon = Polygon()
+
+                if "pose" not in item.do_not_clear:
+                    for pose in item.pose:
+                        pose.pose = Pose()
+
     def get_program(self):
 
         return self._prog
@@ -306,6 +306,25 @@ class TestProgramHelper(unittest.TestCase):
         self.ph.load(self.prog, True)
         self.assertEquals(self.ph.program_learned(), False, "test_template")
 
+    def test_validation_cache(self):
+
+        res = self.ph.load(self.prog)
+        self.assertEquals(res, True, "validation_cache")
+
+        # validation result is shared by all instances
+        prog = deepcopy(self.prog)
+        res = ProgramHelper().load(prog)
+        self.assertEquals(res, True, "validation_cache - copy")
+
+        prog.blocks[0].items[1].on_success = 1234
+        res = self.ph.load(prog)
+        self.assertEquals(res, False, "validation_cache - changed")
+
+        prog.blocks[0].items[1].on_success = 3
+        res = self.ph.load(prog)
+        self.assertEquals(res, True, "validation_cache - reverted")
+        self.assertEquals(self.ph.get_program(), prog, "validation_cache - loaded program")
+
     def test_invalid_ref_id(self):
 
         prog = deepcopy(self.prog)
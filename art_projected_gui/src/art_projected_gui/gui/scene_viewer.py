@@ -2,6 +2,7 @@
 
 from PyQt4 import QtGui, QtCore, QtNetwork
 import rospy
+from art_projected_gui.helpers import FrameDecoder, settings_block, ShmRingReader, shm_path
 
 
 class SceneViewer(QtGui.QWidget):
@@ -16,10 +17,19 @@ class SceneViewer(QtGui.QWidget):
 
         self.ns = "/art/interface/projected_gui/"
 
-        self.server = rospy.get_param(self.ns + "scene_server")
+        # 'shm' (or 'shm:<path>') for shared memory with the GUI running on the same host
+        # empty private param means the global one
+        self.server = rospy.get_param("~scene_server", "") or rospy.get_param(self.ns + "scene_server")
         self.port = rospy.get_param(self.ns + "scene_server_port")
         rospy.loginfo("Server: " + self.server + ":" + str(self.port))
 
+        # requested by this viewer (the server uses its defaults for unset ones)
+        self.settings = {}
+
+        for name in ("rate", "quality", "codecs"):
+            if rospy.has_param("~scene_" + name):
+                self.settings[name] = rospy.get_param("~scene_" + name)
+
         self.show()
 
         self.pix_label = QtGui.QLabel(self)
@@ -29,8 +39,26 @@ class SceneViewer(QtGui.QWidget):
         self.pix_label.resize(self.size())
         self.pix_label.show()
 
+        # last shown frame and its flags (e.g. FRAME_PREWARPED), frames from the shared memory are not kept
+        self.frame = None
+        self.frame_flags = 0
+
+        # seq of the shared memory frame being shown
+        self.frame_seq = None
+
+        self.shm = None
+        path = shm_path(self.server, self.port)
+
+        if path is not None:
+
+            self.shm = ShmRingReader(path)
+            self.shm_timer = QtCore.QTimer(self)
+            self.shm_timer.timeout.connect(self.get_shm_scene)
+
         self.tcpSocket = QtNetwork.QTcpSocket(self)
         self.blockSize = 0
+        self.decoder = FrameDecoder()
+        self.dirty = None
         self.tcpSocket.readyRead.connect(self.getScene)
         self.tcpSocket.error.connect(self.on_error)
 
@@ -43,6 +71,12 @@ class SceneViewer(QtGui.QWidget):
 
     def connect(self):
 
+        if self.shm is not None:
+
+            rospy.loginfo("Reading scene from shared memory: " + self.shm.path)
+            self.shm_timer.start(10)
+            return
+
         r = rospy.Rate(1.0 / 5)
 
         while not self.tcpSocket.waitForConnected(1) and not self.kill_now:
@@ -52,7 +86,23 @@ class SceneViewer(QtGui.QWidget):
             r.sleep()
 
         if not self.kill_now:
+
             rospy.loginfo('Connected to scene server.')
+            self.send_settings()
+
+    def send_settings(self):
+        """Sends settings to the scene server, they can be changed at any time (if connected, they are sent
+        again)."""
+
+        if self.settings and self.tcpSocket.state() == QtNetwork.QAbstractSocket.ConnectedState:
+            self.tcpSocket.write(settings_block(self.settings))
+
+    def request_frame(self):
+        """Asks the scene server for the whole frame (e.g. after a tile could not be decoded), which also resets
+        what the server thinks the client has (xor)."""
+
+        if self.tcpSocket.state() == QtNetwork.QAbstractSocket.ConnectedState:
+            self.tcpSocket.write(settings_block({"full": 1}))
 
     def on_error(self):
 
@@ -78,27 +128,70 @@ class SceneViewer(QtGui.QWidget):
             if self.tcpSocket.bytesAvailable() < self.blockSize:
                 return
 
+            # the whole block is read first, so that a block which can't be decoded is just skipped
+            block = QtCore.QByteArray(instr.readRawData(self.blockSize))
             self.blockSize = 0
 
-            pix = QtGui.QImage()
-            ba = QtCore.QByteArray()
-            instr >> ba
+            # tiles are composited onto the last frame, so all of them have to be decoded
+            rect = self.decoder.decode(block)
+
+            if rect is None:
+                rospy.logerr("Failed to load image from received data")
+
+                # the frame differs from the one the server encodes against now
+                self.request_frame()
+                continue
+
+            if self.dirty is None:
+                self.dirty = rect
+            else:
+                self.dirty = (min(self.dirty[0], rect[0]), min(self.dirty[1], rect[1]),
+                              max(self.dirty[2], rect[2]), max(self.dirty[3], rect[3]))
 
-            # skip this frame if there is another one in buffer
+            # show only the last frame if there is another one in buffer
             if self.tcpSocket.bytesAvailable() > 0:
                 rospy.logdebug("Frame dropped")
                 continue
 
-            # 16ms
-            if not pix.loadFromData(ba, "JPG"):
-                rospy.logerr("Failed to load image from received data")
-                return
+            rect, self.dirty = self.dirty, None
+            self.frame = self.decoder.frame
+            self.frame_flags = self.decoder.flags
+            self.get_image(self.frame, rect)
+
+    def get_shm_scene(self):
+
+        ret = self.shm.read()
+
+        if ret is None:
+            return
 
-            self.get_image(pix)
+        seq, frame, rect = ret
+        self.frame_flags = 0
 
-    def get_image(self, pix):
+        # frames are used directly from the shared memory (no copy), get_image checks frame_valid before showing
+        self.frame_seq = seq
+        self.get_image(frame, rect)
+        self.frame_seq = None
+
+        if not self.shm.valid(seq):
+
+            rospy.logdebug("Frame overwritten while being shown")
+            self.shm.last_seq = None  # read the current frame again (whole)
+
+    def frame_valid(self):
+        """Returns False if the shared memory frame passed to get_image was overwritten meanwhile (so what was
+        made of it must not be shown)."""
+
+        return self.frame_seq is None or self.shm.valid(self.frame_seq)
+
+    def get_image(self, pix, rect=None):
+        """Shows received frame, rect (x0, y0, x1, y1) is its part which changed since the last call."""
 
         pix = pix.mirrored(vertical=True)
+
+        if not self.frame_valid():
+            return
+
         image = QtGui.QPixmap.fromImage(
             pix.scaled(
                 self.pix_label.width(),
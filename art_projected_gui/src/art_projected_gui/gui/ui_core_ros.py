@@ -9,7 +9,7 @@ from art_projected_gui.items import ObjectItem, ButtonItem, PoseStampedCursorIte
     ProgramListItem, ProgramItem, DialogItem, PolygonItem
 from art_projected_gui.helpers import conversions
 from art_helpers import InterfaceStateManager, ProgramHelper, ArtRobotHelper, UnknownRobot,\
-    RobotParametersNotOnParameterServer
+    RobotParametersNotOnParameterServer, ArtDbHelper
 from art_msgs.srv import NotifyUser, NotifyUserResponse,\
     ProgramErrorResolve, ProgramErrorResolveRequest, ProgramIdTrigger, ProgramIdTriggerRequest, NotifyUserRequest
 from std_msgs.msg import Bool
@@ -109,6 +109,7 @@ class UICoreRos(UICore):
             '/art/interface/hololens/state', HololensState, queue_size=1)
 
         self.art = ArtApiHelper()
+        self.db = ArtDbHelper()
 
         self.start_learning_srv = rospy.ServiceProxy(
             '/art/brain/learning/start', ProgramIdTrigger)  # TODO wait for service? where?
@@ -140,6 +141,7 @@ class UICoreRos(UICore):
 
         rospy.loginfo("Waiting for ART services...")
         self.art.wait_for_api()
+        self.db.wait_for_db_api()
 
         # TODO move this to ArtApiHelper ??
         self.obj_sub = rospy.Subscriber(
@@ -1167,6 +1169,10 @@ class UICoreRos(UICore):
 
             self.remove_object(obj_id)
 
+        # types of all new objects are fetched at once
+        obj_types = self.db.get_object_types(
+            [inst.object_type for inst in msg.instances if not self.get_object(inst.object_id)]) or {}
+
         for inst in msg.instances:
 
             obj = self.get_object(inst.object_id)
@@ -1176,7 +1182,7 @@ class UICoreRos(UICore):
                 obj.set_orientation(conversions.q2a(inst.pose.orientation))
             else:
 
-                obj_type = self.art.get_object_type(inst.object_type)
+                obj_type = obj_types.get(inst.object_type)
 
                 if obj_type:
 
@@ -1 +1,5 @@
 from projector_helper import ProjectorHelper
+from scene_codecs import negotiate
+from scene_stream import SceneEncoder, FrameDecoder, EncoderThread, settings_block, parse_settings, \
+    projector_transform, FRAME_PREWARPED
+from scene_shm import ShmRingWriter, ShmRingReader, shm_path
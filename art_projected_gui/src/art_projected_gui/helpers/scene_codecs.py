@@ -0,0 +1,152 @@
+"""Codecs of scene tiles (see scene_stream).
+
+    jpg - lossy, default (and the only one for clients which do not negotiate any codec)
+    png - lossless, fast compression level
+    zlib - lossless, raw RGB32 pixels compressed by zlib (level 1)
+    rle - lossless, runs of equal pixels, best for flat UI without any compression library
+    xor - lossless, XOR with the frame the client already has + zlib (zlib when client has no frame)
+
+    Raw codecs (zlib, rle, xor) use RGB32 pixels in native byte order - viewer and GUI have to run on machines
+    of the same endianness.
+
+"""
+
+import struct
+import zlib
+import numpy as np
+from PyQt4 import QtCore, QtGui
+
+CODEC_JPG = 0
+CODEC_PNG = 1
+CODEC_ZLIB = 2
+CODEC_RLE = 3
+CODEC_XOR = 4
+
+CODECS = {"jpg": CODEC_JPG, "png": CODEC_PNG, "zlib": CODEC_ZLIB, "rle": CODEC_RLE, "xor": CODEC_XOR}
+
+# for PNG, Qt maps quality to compression level (90 ~ level 1)
+PNG_QUALITY = 90
+ZLIB_LEVEL = 1
+
+RAW_HEADER = struct.Struct("<HHI")  # width, height, number of runs (rle only)
+
+
+def negotiate(requested, default="jpg"):
+    """Returns the first supported codec from comma separated list of codecs requested by client."""
+
+    for name in requested.split(","):
+
+        name = name.strip().lower()
+
+        if name in CODECS:
+            return name
+
+    return default
+
+
+def image_array(img):
+    """Returns HxW uint32 array with pixels of RGB32 QImage (copy)."""
+
+    if img.format() not in (QtGui.QImage.Format_RGB32, QtGui.QImage.Format_ARGB32):
+        img = img.convertToFormat(QtGui.QImage.Format_RGB32)
+
+    arr = np.frombuffer(img.constBits().asstring(img.byteCount()), dtype=np.uint32)
+    return arr.reshape(img.height(), img.bytesPerLine() // 4)[:, :img.width()]
+
+
+def array_image(arr):
+    """Returns RGB32 QImage with pixels from HxW uint32 array."""
+
+    data = np.ascontiguousarray(arr, dtype=np.uint32).tostring()
+    height, width = arr.shape
+
+    # copy, so that the image does not refer to the string
+    return QtGui.QImage(data, width, height, width * 4, QtGui.QImage.Format_RGB32).copy()
+
+
+def rle_encode(arr):
+
+    flat = arr.ravel()
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [flat.size]))).astype(np.uint32)
+
+    return RAW_HEADER.pack(arr.shape[1], arr.shape[0], starts.size) + lengths.tostring() + flat[starts].tostring()
+
+
+def rle_decode(data):
+
+    width, height, runs = RAW_HEADER.unpack_from(data)
+    lengths = np.frombuffer(data, dtype=np.uint32, count=runs, offset=RAW_HEADER.size)
+    values = np.frombuffer(data, dtype=np.uint32, count=runs, offset=RAW_HEADER.size + runs * 4)
+
+    return np.repeat(values, lengths).reshape(height, width)
+
+
+def encode_tile(tile, codec, quality=95, ref=None):
+    """Returns (codec id, data) of tile (QImage).
+
+        ref: the same part of the frame which the client already has (for xor), xor falls back to zlib without it
+
+    """
+
+    if codec in ("jpg", "png"):
+
+        data = QtCore.QByteArray()
+        buffer = QtCore.QBuffer(data)
+        buffer.open(QtCore.QIODevice.WriteOnly)
+
+        if codec == "jpg":
+            tile.save(buffer, "JPG", quality)
+            return CODEC_JPG, data
+
+        tile.save(buffer, "PNG", PNG_QUALITY)
+        return CODEC_PNG, data
+
+    arr = image_array(tile)
+
+    if codec == "rle":
+        return CODEC_RLE, QtCore.QByteArray(rle_encode(arr))
+
+    header = RAW_HEADER.pack(arr.shape[1], arr.shape[0], 0)
+
+    if codec == "xor" and ref is not None:
+        return CODEC_XOR, QtCore.QByteArray(header + zlib.compress((arr ^ image_array(ref)).tostring(), ZLIB_LEVEL))
+
+    if codec in ("zlib", "xor"):
+        return CODEC_ZLIB, QtCore.QByteArray(header + zlib.compress(arr.tostring(), ZLIB_LEVEL))
+
+    raise ValueError("Unknown codec: " + str(codec))
+
+
+def decode_tile(codec_id, data, frame, x, y):
+    """Returns tile (QImage) or None. frame (QImage) is the client's frame, tile will be drawn at (x, y)."""
+
+    if codec_id in (CODEC_JPG, CODEC_PNG):
+
+        tile = QtGui.QImage()
+
+        if not tile.loadFromData(data, "JPG" if codec_id == CODEC_JPG else "PNG"):
+            return None
+
+        return tile
+
+    data = str(data)
+
+    try:
+
+        if codec_id == CODEC_RLE:
+            return array_image(rle_decode(data))
+
+        width, height, _ = RAW_HEADER.unpack_from(data)
+        arr = np.frombuffer(zlib.decompress(data[RAW_HEADER.size:]), dtype=np.uint32).reshape(height, width)
+
+    except (struct.error, zlib.error, ValueError):
+        return None
+
+    if codec_id == CODEC_XOR:
+        arr = arr ^ image_array(frame.copy(x, y, width, height))
+
+    elif codec_id != CODEC_ZLIB:
+        return None
+
+    return array_image(arr)
@@ -0,0 +1,201 @@
+"""Shared-memory transport of raw scene frames for scene viewers running on the same host as the GUI.
+
+    Frames (RGB32, vertically mirrored like the frames sent over TCP) are written to a ring of slots in a memory
+    mapped file (in /dev/shm by default). The header holds sequence number of the last written frame. Each slot
+    holds sequence number of its frame (0 while it is being written), changed part of the frame (x0, y0, x1, y1)
+    and the frame itself. Readers poll the header and use frames directly from the mapped memory.
+
+"""
+
+import ctypes
+import mmap
+import os
+import struct
+import sip
+from PyQt4 import QtGui
+
+SHM_MAGIC = b"ARTSCENE"
+SHM_VERSION = 1
+SHM_HEADER = struct.Struct("<8sIIII")  # magic, version, width, height, slots
+SHM_SEQ = struct.Struct("<Q")
+SHM_SEQ_OFFSET = 32
+SHM_HEADER_SIZE = 64
+SHM_SLOT = struct.Struct("<QIIII")  # seq, x0, y0, x1, y1
+SHM_SLOT_HEADER_SIZE = 32
+
+
+def shm_path(server, port):
+    """Returns path of the ring for scene_server param value 'shm' or 'shm:<path>' or None for other values."""
+
+    if not server.startswith("shm"):
+        return None
+
+    if server.startswith("shm:") and len(server) > 4:
+        return server[4:]
+
+    return "/dev/shm/art_projected_gui_scene_" + str(port)
+
+
+def _slot_offset(slot, width, height):
+
+    return SHM_HEADER_SIZE + slot * (SHM_SLOT_HEADER_SIZE + width * height * 4)
+
+
+class ShmRingWriter(object):
+
+    def __init__(self, path, slots=3):
+
+        self.path = path
+        self.slots = slots
+        self.mm = None
+        self.width = None
+        self.height = None
+        self.seq = 0
+
+    def _create(self, width, height):
+
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+        size = _slot_offset(self.slots, width, height)
+
+        # new file replaces the old one at once, readers notice it and map it again
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+
+            f.write(SHM_HEADER.pack(SHM_MAGIC, SHM_VERSION, width, height, self.slots).ljust(SHM_HEADER_SIZE, b"\0"))
+            f.truncate(size)
+
+        fd = os.open(tmp_path, os.O_RDWR)
+
+        try:
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        os.rename(tmp_path, self.path)
+
+        self.width = width
+        self.height = height
+        self.seq = 0
+
+    def write(self, frame, rect=None):
+        """Writes frame (QImage RGB32, already mirrored), rect (x0, y0, x1, y1) is its changed part."""
+
+        if self.mm is None or frame.width() != self.width or frame.height() != self.height:
+            self._create(frame.width(), frame.height())
+
+        if rect is None:
+            rect = (0, 0, self.width, self.height)
+
+        seq = self.seq + 1
+        offset = _slot_offset(seq % self.slots, self.width, self.height)
+
+        SHM_SLOT.pack_into(self.mm, offset, 0, 0, 0, 0, 0)
+
+        dst = ctypes.addressof(ctypes.c_char.from_buffer(self.mm, offset + SHM_SLOT_HEADER_SIZE))
+        ctypes.memmove(dst, int(frame.bits()), self.width * self.height * 4)
+
+        SHM_SLOT.pack_into(self.mm, offset, seq, *rect)
+        SHM_SEQ.pack_into(self.mm, SHM_SEQ_OFFSET, seq)
+
+        self.seq = seq
+
+    def close(self):
+
+        if self.mm is not None:
+
+            self.mm.close()
+            self.mm = None
+
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class ShmRingReader(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        self.mm = None
+        self.ino = None
+        self.width = None
+        self.height = None
+        self.slots = None
+        self.last_seq = None
+
+    def _open(self):
+
+        try:
+
+            st = os.stat(self.path)
+
+            with open(self.path, "r+b") as f:
+                mm = mmap.mmap(f.fileno(), st.st_size)
+
+        except (IOError, OSError, ValueError):
+            return False
+
+        magic, version, width, height, slots = SHM_HEADER.unpack_from(mm, 0)
+
+        if magic != SHM_MAGIC or version != SHM_VERSION or st.st_size != _slot_offset(slots, width, height):
+
+            mm.close()
+            return False
+
+        # frames of the old mapping are not used after the next read (see read)
+        if self.mm is not None:
+            self.mm.close()
+
+        self.mm = mm
+        self.ino = st.st_ino
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.last_seq = None
+
+        return True
+
+    def read(self):
+        """Returns (seq, frame, rect) of a new frame or None. Frame is QImage using the shared memory, it stays
+        valid until the writer gets to its slot again (see valid) and it must not be used after the next call
+        (the memory may be unmapped). rect is the part changed since the previously
+        read frame (the whole frame if some were missed)."""
+
+        try:
+            ino = os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+        if (self.mm is None or ino != self.ino) and not self._open():
+            return None
+
+        seq = SHM_SEQ.unpack_from(self.mm, SHM_SEQ_OFFSET)[0]
+
+        if seq == 0 or seq == self.last_seq:
+            return None
+
+        offset = _slot_offset(seq % self.slots, self.width, self.height)
+        slot = SHM_SLOT.unpack_from(self.mm, offset)
+
+        # being written again already
+        if slot[0] != seq:
+            return None
+
+        rect = slot[1:] if self.last_seq is not None and seq == self.last_seq + 1 else None
+        self.last_seq = seq
+
+        addr = ctypes.addressof(ctypes.c_char.from_buffer(self.mm, offset + SHM_SLOT_HEADER_SIZE))
+        frame = QtGui.QImage(sip.voidptr(addr), self.width, self.height, QtGui.QImage.Format_RGB32)
+
+        return seq, frame, rect
+
+    def valid(self, seq):
+        """Returns True if frame with given seq was not overwritten."""
+
+        offset = _slot_offset(seq % self.slots, self.width, self.height)
+        return SHM_SLOT.unpack_from(self.mm, offset)[0] == seq
@@ -0,0 +1,427 @@
+"""Incremental streaming of QGraphicsScene to scene viewers (projectors).
+
+    Each frame block (after UInt32 block size) is: UInt16 width, UInt16 height (of the whole frame), UInt8 flags,
+    UInt16 number of tiles and for each tile UInt16 x, UInt16 y, UInt8 codec (see scene_codecs) and QByteArray
+    with encoded image. Tiles are vertically mirrored (as the whole frame used to be) and their positions are
+    in the mirrored frame. The first frame sent to new client covers the whole scene.
+
+    After connecting, client may send its settings as one block (UInt32 block size, QByteArray) with key=value
+    pairs separated by ';' - e.g. rate=10;quality=80;codecs=xor,png (the first supported codec is used).
+    Setting full=1 asks for the whole frame (e.g. when the client failed to decode a frame, so the frame it has
+    is not the one the server expects for xor).
+
+    Client may also ask for frames rendered directly in its (projector) space by sending its homography (from
+    the mirrored scene frame to projector pixels, 9 comma separated values, row-major) and size - e.g.
+    homography=1,0,0,0,1,0,0,0,1;size=1920,1080. Such frames have FRAME_PREWARPED flag set.
+
+"""
+
+import threading
+import numpy as np
+import rospy
+from PyQt4 import QtCore, QtGui
+from art_projected_gui.helpers.scene_codecs import encode_tile, decode_tile
+
+
+FRAME_PREWARPED = 1
+
+
+def projector_transform(h, scene_height, height):
+    """Returns QTransform from scene frame coordinates to (mirrored) frame of projector with given height.
+
+        h: homography from mirrored scene frame to projector pixels (3x3)
+
+    """
+
+    def flip(size):
+
+        return np.array([[1.0, 0.0, 0.0], [0.0, -1.0, size], [0.0, 0.0, 1.0]])
+
+    # frames are mirrored when sent, so the projector gets exactly its output
+    m = flip(height).dot(np.asarray(h, dtype=np.float64)).dot(flip(scene_height))
+
+    # QTransform uses transposed matrix (row vectors)
+    return QtGui.QTransform(m[0, 0], m[1, 0], m[2, 0], m[0, 1], m[1, 1], m[2, 1], m[0, 2], m[1, 2], m[2, 2])
+
+
+def settings_block(settings):
+    """Returns block with client settings (dict)."""
+
+    block = QtCore.QByteArray()
+    out = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
+    out.setVersion(QtCore.QDataStream.Qt_4_0)
+    out.writeUInt32(0)
+    out << QtCore.QByteArray(";".join(str(k) + "=" + str(v) for k, v in settings.iteritems()))
+    out.device().seek(0)
+    out.writeUInt32(block.size() - 4)
+
+    return block
+
+
+def parse_settings(data):
+    """Returns dict of client settings (values are strings) from received QByteArray."""
+
+    settings = {}
+
+    for item in str(data).split(";"):
+
+        if "=" in item:
+            k, v = item.split("=", 1)
+            settings[k.strip()] = v.strip()
+
+    return settings
+
+
+class DirtyTiles(object):
+
+    """Collects changed regions of the scene (QGraphicsScene.changed) as a set of tiles.
+
+        transform: QTransform from scene frame to the output frame (if it is not the scene frame)
+
+    """
+
+    def __init__(self, scene, tile_size=64, margin=2, transform=None):
+
+        self.scene = scene
+        self.transform = transform
+        self.tile_size = tile_size
+        self.margin = margin  # covers antialiasing outside of item bounding rects
+        self.tiles = set()
+        self.all = True
+
+        self.scene.changed.connect(self.scene_changed)
+
+    def mark_all(self):
+
+        self.all = True
+
+    def close(self):
+
+        self.scene.changed.disconnect(self.scene_changed)
+
+    def scene_changed(self, rects):
+
+        if self.all:
+            return
+
+        origin = self.scene.sceneRect().topLeft()
+        ts = self.tile_size
+
+        for rect in rects:
+
+            r = rect.translated(-origin.x(), -origin.y())
+
+            if self.transform is not None:
+                r = self.transform.mapRect(r)
+
+            r = r.toAlignedRect()
+            r.adjust(-self.margin, -self.margin, self.margin, self.margin)
+
+            for row in range(max(r.top(), 0) // ts, max(r.bottom(), 0) // ts + 1):
+                for col in range(max(r.left(), 0) // ts, max(r.right(), 0) // ts + 1):
+                    self.tiles.add((row, col))
+
+    def take(self, width, height):
+        """Returns list of dirty QRects (frame coordinates, runs of tiles in rows) and clears them."""
+
+        frame = QtCore.QRect(0, 0, width, height)
+
+        if self.all:
+
+            self.all = False
+            self.tiles.clear()
+            return [frame]
+
+        ts = self.tile_size
+        rects = []
+
+        for row, col in sorted(self.tiles):
+
+            rect = QtCore.QRect(col * ts, row * ts, ts, ts).intersected(frame)
+
+            if rect.isEmpty():
+                continue
+
+            # merge with previous tile in the same row
+            if rects and rects[-1].top() == rect.top() and rects[-1].right() + 1 == rect.left():
+                rects[-1] = rects[-1].united(rect)
+            else:
+                rects.append(rect)
+
+        self.tiles.clear()
+        return rects
+
+
+def encode_tiles(width, height, tiles, quality=95, codec="jpg", ref=None, flags=0):
+    """Returns frame block (QByteArray) with given tiles - list of (QRect, QImage) in scene orientation.
+
+        ref: frame (QImage) which the client already has (for xor codec)
+
+        Uses only QImage (no painting on the scene), so it can be called from any thread.
+
+    """
+
+    block = QtCore.QByteArray()
+    out = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
+    out.setVersion(QtCore.QDataStream.Qt_4_0)
+    out.writeUInt32(0)
+
+    out.writeUInt16(width)
+    out.writeUInt16(height)
+    out.writeUInt8(flags)
+    out.writeUInt16(len(tiles))
+
+    for rect, tile in tiles:
+
+        ref_tile = ref.copy(rect).mirrored() if ref is not None else None
+        codec_id, data = encode_tile(tile.mirrored(), codec, quality, ref_tile)
+
+        out.writeUInt16(rect.x())
+        out.writeUInt16(height - rect.y() - rect.height())
+        out.writeUInt8(codec_id)
+        out << data
+
+    out.device().seek(0)
+    out.writeUInt32(block.size() - 4)
+
+    return block
+
+
+def encode_rects(frame, rects, quality=95, codec="jpg", ref=None, flags=0):
+    """Returns frame block with given parts (QRects) of the frame (QImage), can be called from any thread."""
+
+    return encode_tiles(frame.width(), frame.height(), [(rect, frame.copy(rect)) for rect in rects], quality,
+                        codec, ref, flags)
+
+
+class SceneEncoder(object):
+
+    """Renders dirty parts of the scene and encodes them as frame blocks.
+
+        With transform (QTransform from scene frame) and size (width, height), the scene is rendered directly
+        into the output frame (e.g. projector space, see projector_transform).
+
+    """
+
+    def __init__(self, scene, quality=95, transform=None, size=None):
+
+        self.scene = scene
+        self.quality = quality
+        self.transform = transform
+        self.size = size
+        self.flags = FRAME_PREWARPED if transform is not None else 0
+        self.tiles = DirtyTiles(scene, transform=transform)
+        self.frame = None
+
+    def close(self):
+
+        self.tiles.close()
+
+    def capture(self, force=False):
+        """Renders changed parts of the scene, has to be called from the GUI thread.
+
+            Returns (rects, frame) - QRects changed since the last call and copy of the whole frame (QImage).
+            Returns None if nothing changed (unless force is set).
+
+        """
+
+        if self.size is not None:
+            width, height = self.size
+        else:
+            width = int(self.scene.width())
+            height = int(self.scene.height())
+
+        if self.frame is None or self.frame.width() != width or self.frame.height() != height:
+
+            self.frame = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+            self.tiles.mark_all()
+
+        rects = self.tiles.take(width, height)
+
+        if not rects and not force:
+            return None
+
+        origin = self.scene.sceneRect().topLeft()
+
+        painter = QtGui.QPainter(self.frame)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+
+        if self.transform is not None and rects:
+
+            region = QtGui.QRegion()
+
+            for rect in rects:
+                region = region.united(QtGui.QRegion(rect))
+
+            # the whole scene is rendered through the transform, only the changed part of the output is painted
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+            painter.setClipRegion(region)
+            painter.fillRect(self.frame.rect(), QtCore.Qt.black)
+            painter.setTransform(self.transform)
+            self.scene.render(painter, QtCore.QRectF(0, 0, self.scene.width(), self.scene.height()),
+                              self.scene.sceneRect())
+
+        else:
+
+            for rect in rects:
+
+                painter.fillRect(rect, QtCore.Qt.black)
+                self.scene.render(painter, QtCore.QRectF(rect), QtCore.QRectF(rect).translated(origin))
+
+        painter.end()
+
+        return rects, self.frame.copy()
+
+    def encode(self):
+        """Returns frame block (QByteArray) or None when nothing changed since the last call."""
+
+        capture = self.capture()
+
+        if capture is None:
+            return None
+
+        rects, frame = capture
+        return encode_rects(frame, rects, self.quality, flags=self.flags)
+
+
+class EncoderThread(threading.Thread):
+
+    """Encodes captured frames (see SceneEncoder.capture) outside of the GUI thread.
+
+        Each job is (frame, rects, quality, codec, ref, flags, clients), the same part of the frame is encoded only
+        once for all clients in a job (ref is the frame the clients already have, see encode_tiles). When done, cb
+        is called (from this thread) with list of (block, clients), block is None if it could not be encoded.
+        cb is called for every put, even if something fails. Only the latest jobs wait for encoding.
+        Raw frames are also written to shared memory ring (ShmRingWriter) if given.
+
+    """
+
+    def __init__(self, cb, ring=None):
+
+        super(EncoderThread, self).__init__()
+
+        self.daemon = True
+        self.cb = cb
+        self.ring = ring
+        self.cond = threading.Condition()
+        self.pending = None
+
+    def put(self, jobs, ring_frame=None, ring_rects=None):
+        """ring_frame, ring_rects: scene frame and its changed parts (QRects) to be written to the ring."""
+
+        with self.cond:
+
+            self.pending = (jobs, ring_frame, ring_rects)
+            self.cond.notify()
+
+    def write_ring(self, frame, rects):
+
+        height = frame.height()
+
+        # changed part of the mirrored frame
+        rect = (min(r.x() for r in rects), height - max(r.y() + r.height() for r in rects),
+                max(r.x() + r.width() for r in rects), height - min(r.y() for r in rects))
+
+        self.ring.write(frame.mirrored(), rect)
+
+    def run(self):
+
+        while True:
+
+            with self.cond:
+
+                while self.pending is None:
+                    self.cond.wait()
+
+                jobs, ring_frame, ring_rects = self.pending
+                self.pending = None
+
+            blocks = []
+
+            try:
+
+                if self.ring is not None and ring_rects:
+
+                    try:
+                        self.write_ring(ring_frame, ring_rects)
+                    except Exception as e:
+                        rospy.logerr("Failed to write scene frame to shared memory: " + str(e))
+
+                for frame, rects, quality, codec, ref, flags, clients in jobs:
+
+                    try:
+                        block = encode_rects(frame, rects, quality, codec, ref, flags)
+                    except Exception as e:
+                        rospy.logerr("Failed to encode scene frame: " + str(e))
+                        block = None
+
+                    blocks.append((block, clients))
+
+            finally:
+
+                # the GUI does not post new frames until it gets the result
+                self.cb(blocks)
+
+
+class FrameDecoder(object):
+
+    """Composites received tiles onto the last frame (QImage)."""
+
+    def __init__(self):
+
+        self.frame = None
+        self.flags = 0
+
+    def decode(self, block):
+        """Composites one frame block (QByteArray, without block size).
+
+            Returns changed part of the frame (x0, y0, x1, y1) or None if the data could not be decoded.
+
+        """
+
+        instr = QtCore.QDataStream(block)
+        instr.setVersion(QtCore.QDataStream.Qt_4_0)
+
+        width = instr.readUInt16()
+        height = instr.readUInt16()
+        self.flags = instr.readUInt8()
+        count = instr.readUInt16()
+
+        if instr.status() != QtCore.QDataStream.Ok:
+            return None
+
+        if self.frame is None or self.frame.width() != width or self.frame.height() != height:
+
+            self.frame = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+            self.frame.fill(QtGui.QColor(QtCore.Qt.black).rgb())
+
+        tiles = []
+
+        for _ in range(count):
+
+            x = instr.readUInt16()
+            y = instr.readUInt16()
+            codec_id = instr.readUInt8()
+            data = QtCore.QByteArray()
+            instr >> data
+
+            if instr.status() != QtCore.QDataStream.Ok:
+                return None
+
+            # xor tiles refer to the frame, so each tile is drawn right away
+            tile = decode_tile(codec_id, data, self.frame, x, y)
+
+            if tile is None:
+                return None
+
+            painter = QtGui.QPainter(self.frame)
+            painter.drawImage(x, y, tile)
+            painter.end()
+
+            tiles.append((x, y, tile))
+
+        if not tiles:
+            return None
+
+        return (min(x for x, _, _ in tiles), min(y for _, y, _ in tiles),
+                max(x + tile.width() for x, _, tile in tiles), max(y + tile.height() for _, y, tile in tiles))
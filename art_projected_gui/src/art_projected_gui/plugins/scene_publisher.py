@@ -1,17 +1,145 @@
 from art_projected_gui.plugins import GuiPlugin
+from art_projected_gui.helpers import SceneEncoder, EncoderThread, parse_settings, ShmRingWriter, shm_path, negotiate, \
+    projector_transform, FRAME_PREWARPED
 import rospy
-from PyQt4 import QtCore, QtNetwork, QtGui
+from PyQt4 import QtCore, QtNetwork
 
 translate = QtCore.QCoreApplication.translate
 
 
+class SceneClient(object):
+
+    """Connected scene viewer and its settings (rate, quality, codec) - defaults can be changed by the client.
+
+        Client which sent its homography gets frames rendered in its space by its own encoder.
+
+    """
+
+    def __init__(self, socket, scene, rate, quality, codec):
+
+        self.socket = socket
+        self.scene = scene
+        self.encoder = None
+        self.rate = rate
+        self.quality = quality
+        self.codec = codec
+        self.ref = None  # frame the client has (kept for xor codec only)
+
+        self.block_size = 0
+        self.next_send = 0.0
+
+        # parts of the frame (x, y, w, h) changed since the last frame sent to this client
+        self.pending = set()
+        self.full = True  # new client or too many changes
+
+    def add_pending(self, rects, max_rects=64):
+
+        if self.full:
+            return
+
+        self.pending.update((r.x(), r.y(), r.width(), r.height()) for r in rects)
+
+        if len(self.pending) > max_rects:
+
+            self.pending.clear()
+            self.full = True
+
+    def pending_rects(self, width, height):
+
+        if self.full:
+            return ((0, 0, width, height), )
+
+        return tuple(sorted(self.pending))
+
+    def read_settings(self):
+
+        instr = QtCore.QDataStream(self.socket)
+        instr.setVersion(QtCore.QDataStream.Qt_4_0)
+
+        while True:
+
+            if self.block_size == 0:
+                if self.socket.bytesAvailable() < 4:
+                    return
+
+                self.block_size = instr.readUInt32()
+
+            if self.socket.bytesAvailable() < self.block_size:
+                return
+
+            # settings are parsed from their own block, so that a malformed one can't break the following ones
+            block = QtCore.QDataStream(QtCore.QByteArray(instr.readRawData(self.block_size)))
+            block.setVersion(QtCore.QDataStream.Qt_4_0)
+            self.block_size = 0
+
+            data = QtCore.QByteArray()
+            block >> data
+            settings = parse_settings(data)
+
+            try:
+
+                if "rate" in settings and float(settings["rate"]) > 0:
+                    self.rate = min(float(settings["rate"]), self.rate)
+
+                if "quality" in settings:
+                    self.quality = max(0, min(int(settings["quality"]), 100))
+
+                if "codecs" in settings:
+                    self.codec = negotiate(settings["codecs"], self.codec)
+
+                # client's frame has to be known for xor
+                if "codecs" in settings or "full" in settings:
+
+                    self.full = True
+                    self.ref = None
+
+                if "homography" in settings and "size" in settings:
+                    self.set_homography([float(v) for v in settings["homography"].split(",")],
+                                        [int(v) for v in settings["size"].split(",")])
+
+            except ValueError:
+                rospy.logwarn("Invalid scene client settings: " + str(settings))
+
+            rospy.loginfo("Scene client settings: rate " + str(self.rate) + " Hz, quality " + str(self.quality) +
+                          ", codec " + self.codec + (", projector space" if self.encoder is not None else ""))
+
+    def set_homography(self, h, size):
+
+        if len(h) != 9 or len(size) != 2:
+            raise ValueError("Invalid homography or size")
+
+        self.close()
+
+        h = [h[0:3], h[3:6], h[6:9]]
+        self.encoder = SceneEncoder(self.scene, self.quality, projector_transform(h, self.scene.height(), size[1]),
+                                    tuple(size))
+
+        self.full = True
+        self.ref = None
+
+    def close(self):
+
+        if self.encoder is not None:
+
+            self.encoder.close()
+            self.encoder = None
+
+
 class ScenePublisherPlugin(GuiPlugin):
 
     def __init__(self, ui, parameters):
 
         super(ScenePublisherPlugin, self).__init__(ui)
 
-        self.port = 1234  # TODO read from param
+        self.port = rospy.get_param(GuiPlugin.BASE_NS + "scene_server_port", 1234)
+
+        # defaults for clients, rate is also the maximal one
+        self.rate = max(float(parameters.get("rate", 15.0)), 1.0)
+        self.quality = int(parameters.get("quality", 95))
+        self.codec = negotiate(parameters.get("codec", "jpg"))
+
+        # frames are dropped for client which has more data waiting to be sent
+        self.max_queue_bytes = int(parameters.get("max_queue_bytes", 4 * 1024 * 1024))
 
         self.tcpServer = QtNetwork.QTcpServer(self)
         if not self.tcpServer.listen(port=self.port):
@@ -21,59 +149,164 @@ class ScenePublisherPlugin(GuiPlugin):
         self.tcpServer.newConnection.connect(self.new_connection)
         self.connections = []
 
+        # only changed parts of the scene are rendered (in GUI thread) and then encoded once for all clients
+        # with the same needs in the encoder thread
+        self.encoder = SceneEncoder(self.ui.scene)
+        self.encoder_busy = False
+
+        # raw frames for viewers on this host (scene_server set to 'shm')
+        self.ring = None
+
+        if parameters.get("shared_memory", False):
+
+            self.ring = ShmRingWriter(shm_path("shm", self.port))
+            rospy.loginfo('Writing scene to shared memory: ' + self.ring.path)
+
+        self.encoder_thread = EncoderThread(self.frame_encoded_cb, self.ring)
+        self.encoder_thread.start()
+
+        self.connect(self, QtCore.SIGNAL('frame_encoded'), self.frame_encoded_evt)
+
         self.scene_timer = QtCore.QTimer()
         self.connect(
             self.scene_timer,
             QtCore.SIGNAL('timeout()'),
             self.send_to_clients_evt)
-        self.scene_timer.start(1.0 / 15 * 1000)
+        self.scene_timer.start(1.0 / self.rate * 1000)
 
     def new_connection(self):
 
         rospy.loginfo('Some projector node just connected.')
-        self.connections.append(self.tcpServer.nextPendingConnection())
-        self.connections[-1].setSocketOption(
-            QtNetwork.QAbstractSocket.LowDelayOption, 1)
 
-        # TODO deal with disconnected clients!
-        # self.connections[-1].disconnected.connect(clientConnection.deleteLater)
+        client = SceneClient(self.tcpServer.nextPendingConnection(), self.ui.scene, self.rate, self.quality,
+                             self.codec)
+        client.socket.setSocketOption(QtNetwork.QAbstractSocket.LowDelayOption, 1)
+        client.socket.readyRead.connect(client.read_settings)
+        client.socket.disconnected.connect(lambda: self.client_disconnected(client))
+
+        self.connections.append(client)
+
+    def client_disconnected(self, client):
+
+        if client not in self.connections:
+            return
+
+        rospy.loginfo('Projector node disconnected.')
+        self.connections.remove(client)
+        client.close()
+        client.socket.deleteLater()
+
+    def client_ready(self, client, now):
+
+        if client.socket.state() != QtNetwork.QAbstractSocket.ConnectedState:
+            return False
+
+        return now >= client.next_send and client.socket.bytesToWrite() <= self.max_queue_bytes
 
     def send_to_clients_evt(self):
 
-        if len(self.connections) == 0:
+        # changes are accumulated until the encoder is done with the previous frame
+        if (len(self.connections) == 0 and self.ring is None) or self.encoder_busy:
+            return
+
+        now = rospy.get_time()
+        ready = [client for client in self.connections if self.client_ready(client, now)]
+
+        if not ready and self.ring is None:
+            return
+
+        # clients getting the scene frame (others have their own encoders)
+        shared = [client for client in ready if client.encoder is None]
+
+        jobs = []
+        rects = []
+        frame = None
+
+        if shared or self.ring is not None:
+
+            # clients which were not ready when their changes were captured need the frame even if the scene is
+            # static now (no dirty tiles - rects are empty)
+            capture = self.encoder.capture(force=any(client.full or client.pending for client in shared))
+
+            if capture is not None:
+
+                rects, frame = capture
+
+                for client in self.connections:
+                    if client.encoder is None:
+                        client.add_pending(rects)
+
+        # clients which need the same part of the frame in the same quality and codec (and have the same frame
+        # for xor) share one encoded block
+        groups = {}
+
+        for client in (shared if frame is not None else []):
+
+            if not client.full and not client.pending:
+                continue
+
+            ref = client.ref if not client.full else None
+            key = (client.pending_rects(frame.width(), frame.height()), client.quality, client.codec, id(ref))
+            groups.setdefault(key, (ref, []))[1].append(client)
+
+            # lossless codec - client will have exactly this frame
+            client.ref = frame if client.codec == "xor" else None
+            client.pending.clear()
+            client.full = False
+            client.next_send = now + 1.0 / client.rate
+
+        for (job_rects, quality, codec, _), (ref, clients) in groups.iteritems():
+            jobs.append((frame, [QtCore.QRect(*r) for r in job_rects], quality, codec, ref, 0, clients))
+
+        # rendered directly in projector space
+        for client in ready:
+
+            if client.encoder is None:
+                continue
+
+            if client.full:
+                client.encoder.tiles.mark_all()
+
+            capture = client.encoder.capture()
+
+            if capture is None:
+                continue
+
+            client_rects, client_frame = capture
+            ref = client.ref if not client.full else None
+            jobs.append((client_frame, client_rects, client.quality, client.codec, ref, FRAME_PREWARPED, [client]))
+
+            client.ref = client_frame if client.codec == "xor" else None
+            client.full = False
+            client.next_send = now + 1.0 / client.rate
+
+        if not jobs and (self.ring is None or not rects):
             return
 
-        # start = time.time()
+        self.encoder_busy = True
+        self.encoder_thread.put(jobs, frame, rects)
+
+    def frame_encoded_cb(self, blocks):
 
-        pix = QtGui.QImage(
-            self.ui.scene.width(),
-            self.ui.scene.height(),
-            QtGui.QImage.Format_RGB888)
-        painter = QtGui.QPainter(pix)
-        painter.setRenderHint(QtGui.QPainter.Antialiasing)
-        self.ui.scene.render(painter)
-        painter.end()
-        pix = pix.mirrored()
+        # called from the encoder thread, sockets are written from GUI thread
+        self.emit(QtCore.SIGNAL('frame_encoded'), blocks)
 
-        block = QtCore.QByteArray()
-        out = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
-        out.setVersion(QtCore.QDataStream.Qt_4_0)
-        out.writeUInt32(0)
+    def frame_encoded_evt(self, blocks):
 
-        img = QtCore.QByteArray()
-        buffer = QtCore.QBuffer(img)
-        buffer.open(QtCore.QIODevice.WriteOnly)
-        pix.save(buffer, "JPG", 95)
-        out << img
+        self.encoder_busy = False
 
-        out.device().seek(0)
-        out.writeUInt32(block.size() - 4)
+        for block, clients in blocks:
+            for client in clients:
 
-        # print block.size()
+                # client disconnected meanwhile
+                if client not in self.connections:
+                    continue
 
-        for con in self.connections:
+                # client did not get the changes, it needs the whole frame
+                if block is None:
 
-            con.write(block)
+                    client.full = True
+                    client.ref = None
+                    continue
 
-        # end = time.time()
-        # rospy.logdebug("Image sent in: " + str(end-start))
+                client.socket.write(block)
@@ -4,7 +4,7 @@ import sys
 import signal
 import rospy
 from PyQt4 import QtGui, QtCore, QtNetwork
-from art_projected_gui.helpers import ProjectorHelper
+from art_projected_gui.helpers import ProjectorHelper, SceneEncoder
 
 
 class customGraphicsView(QtGui.QGraphicsView):
@@ -51,6 +51,7 @@ class ExampleGui(QtCore.QObject):
 
         self.tcpServer.newConnection.connect(self.new_connection)
         self.connections = []
+        self.encoder = SceneEncoder(self.scene)
 
         self.scene_timer = QtCore.QTimer()
         self.connect(
@@ -86,6 +87,7 @@ class ExampleGui(QtCore.QObject):
         self.connections.append(self.tcpServer.nextPendingConnection())
         self.connections[-1].setSocketOption(
             QtNetwork.QAbstractSocket.LowDelayOption, 1)
+        self.encoder.tiles.mark_all()
 
         # TODO deal with disconnected clients!
         # self.connections[-1].disconnected.connect(clientConnection.deleteLater)
@@ -97,31 +99,10 @@ class ExampleGui(QtCore.QObject):
 
         # start = time.time()
 
-        pix = QtGui.QImage(
-            self.scene.width(),
-            self.scene.height(),
-            QtGui.QImage.Format_RGB888)
-        painter = QtGui.QPainter(pix)
-        painter.setRenderHint(QtGui.QPainter.Antialiasing)
-        self.scene.render(painter)
-        painter.end()
-        pix = pix.mirrored()
-
-        block = QtCore.QByteArray()
-        out = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
-        out.setVersion(QtCore.QDataStream.Qt_4_0)
-        out.writeUInt32(0)
-
-        img = QtCore.QByteArray()
-        buffer = QtCore.QBuffer(img)
-        buffer.open(QtCore.QIODevice.WriteOnly)
-        pix.save(buffer, "JPG", 95)
-        out << img
-
-        out.device().seek(0)
-        out.writeUInt32(block.size() - 4)
-
-        # print block.size()
+        block = self.encoder.encode()
+
+        if block is None:
+            return
 
         for con in self.connections:
             con.write(block)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from PyQt4 import QtCore
+from art_projected_gui.helpers import negotiate, settings_block, parse_settings
+from art_projected_gui.helpers.scene_codecs import rle_encode, rle_decode, encode_tile, decode_tile, \
+    image_array, array_image, CODEC_XOR, CODEC_ZLIB, CODEC_RLE
+
+
+class TestSceneCodecs(unittest.TestCase):
+
+    def setUp(self):
+
+        rnd = np.random.RandomState(0)
+
+        # flat areas (like the UI) with some noise
+        arr = np.zeros((48, 64), dtype=np.uint32)
+        arr[10:30, 5:40] = 0xff336699
+        arr[20:40, 30:60] = 0xffcc0000
+        arr[::7, ::5] = rnd.randint(0, 2 ** 31, arr[::7, ::5].shape)
+
+        self.arr = arr
+
+    def test_negotiate(self):
+
+        self.assertEqual(negotiate("xor,zlib,jpg"), "xor")
+        self.assertEqual(negotiate(" PNG , jpg"), "png")
+        self.assertEqual(negotiate("webp,zlib"), "zlib")
+        self.assertEqual(negotiate("webp"), "jpg")
+        self.assertEqual(negotiate(""), "jpg")
+        self.assertEqual(negotiate("webp", "rle"), "rle")
+
+    def test_parse_settings(self):
+
+        settings = parse_settings(QtCore.QByteArray("rate=10; codecs = xor,zlib;invalid;homography=1,0,0=1"))
+
+        self.assertEqual(settings, {"rate": "10", "codecs": "xor,zlib", "homography": "1,0,0=1"})
+        self.assertEqual(parse_settings(QtCore.QByteArray()), {})
+
+    def test_settings_block(self):
+
+        block = settings_block({"rate": 15, "codecs": "xor,jpg"})
+
+        instr = QtCore.QDataStream(block)
+        instr.setVersion(QtCore.QDataStream.Qt_4_0)
+
+        self.assertEqual(instr.readUInt32(), block.size() - 4)
+
+        data = QtCore.QByteArray()
+        instr >> data
+
+        self.assertEqual(parse_settings(data), {"rate": "15", "codecs": "xor,jpg"})
+
+    def test_rle(self):
+
+        data = rle_encode(self.arr)
+        self.assertTrue(np.array_equal(rle_decode(data), self.arr))
+
+        flat = np.full((10, 20), 0xff000000, dtype=np.uint32)
+        self.assertTrue(np.array_equal(rle_decode(rle_encode(flat)), flat))
+
+        # one run only
+        self.assertLess(len(rle_encode(flat)), 20)
+
+    def test_rle_tile(self):
+
+        tile = array_image(self.arr)
+        codec_id, data = encode_tile(tile, "rle")
+
+        self.assertEqual(codec_id, CODEC_RLE)
+        self.assertTrue(np.array_equal(image_array(decode_tile(codec_id, data, None, 0, 0)), self.arr))
+
+    def test_xor(self):
+
+        x, y, w, h = 8, 4, 32, 24
+
+        frame = array_image(self.arr)  # the client's frame
+
+        arr = self.arr.copy()
+        arr[y + 5:y + 10, x:x + 20] = 0xff00ff00
+        tile = array_image(arr[y:y + h, x:x + w])
+
+        codec_id, data = encode_tile(tile, "xor", ref=frame.copy(x, y, w, h))
+        self.assertEqual(codec_id, CODEC_XOR)
+
+        decoded = decode_tile(codec_id, data, frame, x, y)
+        self.assertTrue(np.array_equal(image_array(decoded), arr[y:y + h, x:x + w]))
+
+    def test_xor_without_ref(self):
+
+        tile = array_image(self.arr)
+        codec_id, data = encode_tile(tile, "xor")
+
+        self.assertEqual(codec_id, CODEC_ZLIB)
+        self.assertTrue(np.array_equal(image_array(decode_tile(codec_id, data, None, 0, 0)), self.arr))
+
+    def test_corrupted(self):
+
+        codec_id, data = encode_tile(array_image(self.arr), "zlib")
+
+        self.assertIsNone(decode_tile(codec_id, data.left(data.size() // 2), None, 0, 0))
+        self.assertIsNone(decode_tile(CODEC_XOR, QtCore.QByteArray("xx"), None, 0, 0))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
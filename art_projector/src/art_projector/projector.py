@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import pickle
 import os
 import ast
 from PyQt4 import QtGui, QtCore
@@ -18,6 +17,8 @@ from geometry_msgs.msg import Pose, PoseArray
 import tf
 from art_utils import array_from_param
 from art_projected_gui.gui import SceneViewer
+from art_projected_gui.helpers import FRAME_PREWARPED
+from art_projector.warp import Warper, load_maps, save_maps
 import rospkg
 
 
@@ -75,8 +76,15 @@ class Projector(SceneViewer):
         # padding serves to restrict area usable for calibration (flat surface)
         self.padding = Padding()
 
-        self.map_x = None
-        self.map_y = None
+        self.warper = None
+
+        self.warp_method = rospy.get_param('~warp/method', 'perspective')
+        self.warp_interpolation = {'linear': cv2.INTER_LINEAR, 'nearest': cv2.INTER_NEAREST}[
+            rospy.get_param('~warp/interpolation', 'linear')]
+        self.warp_dirty_roi = rospy.get_param('~warp/dirty_roi', True)
+
+        # scene is rendered in projector space by the server (TCP only), warping is skipped
+        self.prewarp = rospy.get_param('~prewarp', False)
 
         self.dx = None
         self.dy = None
@@ -141,18 +149,7 @@ class Projector(SceneViewer):
             self.calibrated = True
             self.calibrated_pub.publish(self.is_calibrated())
 
-            try:
-                with open(self.map_path, 'rb') as f:
-
-                    self.map_x, self.map_y = pickle.load(f)
-                    self.maps_ready = True
-                    rospy.loginfo("Map loaded from file")
-
-            except (IOError, OSError) as e:  # TODO pickle exceptions?
-                rospy.logwarn("Failed to load map from file")
-
-            if not self.maps_ready:
-                self.init_map_from_matrix(np.matrix(ast.literal_eval(h_matrix)))
+            self.init_map_from_matrix(np.matrix(ast.literal_eval(h_matrix)))
         else:
 
             try:
@@ -164,44 +161,53 @@ class Projector(SceneViewer):
 
     def init_map_from_matrix(self, m):
 
-        rospy.loginfo("Building map from calibration matrix...")
-
         self.maps_ready = False
 
-        Hd = self.height()
-        Wd = self.width()
+        maps = None
 
-        self.map_x = np.zeros((Hd, Wd), np.float32)
-        self.map_y = np.zeros((Hd, Wd), np.float32)
+        if self.warp_method == 'remap':
 
-        m = np.linalg.inv(m)
+            maps = load_maps(self.map_path, m, self.width(), self.height())
 
-        for y in range(0, int(Hd - 1)):
-            for x in range(0, int(Wd - 1)):
-                self.map_x.itemset(
-                    (y, x), (m[0, 0] * x + m[0, 1] * y + m[0, 2]) / (m[2, 0] * x + m[2, 1] * y + m[2, 2]))
-                self.map_y.itemset(
-                    (y, x), (m[1, 0] * x + m[1, 1] * y + m[1, 2]) / (m[2, 0] * x + m[2, 1] * y + m[2, 2]))
+            if maps is not None:
+                rospy.loginfo("Map loaded from file")
+            else:
+                rospy.loginfo("Building map from calibration matrix...")
 
-        self.map_x, self.map_y = cv2.convertMaps(
-            self.map_x, self.map_y, cv2.CV_16SC2)
-        self.maps_ready = True
+        self.warper = Warper(m, self.width(), self.height(), self.warp_method, self.warp_interpolation,
+                             self.warp_dirty_roi, maps)
 
-        try:
-            with open(self.map_path, 'wb') as f:
+        if self.warp_method == 'remap' and maps is None:
+
+            # maps were built by Warper (there were none or they were for other calibration / resolution)
+            try:
+                save_maps(self.map_path, m, self.width(), self.height(), self.warper.maps)
+            except (IOError, OSError) as e:
+                rospy.logerr("Failed to store map to file: " + str(e))
 
-                pickle.dump((self.map_x, self.map_y), f)
+        if self.prewarp:
 
-        except (IOError, OSError) as e:
-            rospy.logerr("Failed to store map to file: " + str(e))
+            self.settings["homography"] = ",".join(str(v) for v in np.asarray(m, dtype=np.float64).flatten())
+            self.settings["size"] = str(self.width()) + "," + str(self.height())
+            self.send_settings()
 
-        rospy.loginfo("Done!")
+        self.maps_ready = True
 
     def show_pix_label_evt(self, show):
 
         if show:
             self.pix_label.clear()
             self.pix_label.show()
+
+            # static scene is not sent again - show the last frame
+            if self.warper is not None:
+
+                self.warper.invalidate()
+
+                if self.shm is not None:
+                    self.shm.last_seq = None  # read the current frame again (whole)
+                elif self.frame is not None:
+                    self.get_image(self.frame)
         else:
             self.pix_label.hide()
 
@@ -210,23 +216,40 @@ class Projector(SceneViewer):
         self.projectors_calibrated = msg.data
         self.emit(QtCore.SIGNAL('show_pix_label'), self.projectors_calibrated)
 
-    def get_image(self, pix):
+    def get_image(self, pix, rect=None):
 
         if self.calibrating or not self.projectors_calibrated or not self.maps_ready:
+
+            # changes of the scene are not tracked meanwhile
+            if self.warper is not None:
+                self.warper.invalidate()
+
+            return
+
+        if self.frame_flags & FRAME_PREWARPED:
+
+            # already in projector space (and not mirrored)
+            self.pix_label.setPixmap(QtGui.QPixmap.fromImage(pix))
+            self.update()
+            return
+
+        if pix.format() not in (QtGui.QImage.Format_RGB32, QtGui.QImage.Format_ARGB32):
+            pix = pix.convertToFormat(QtGui.QImage.Format_RGB32)
+
+        # warped in place (no conversion to RGB), only changed part of the scene by default
+        out = self.warper.warp(qimage2ndarray.byte_view(pix), rect)
+
+        if out is None:
             return
 
-        # 3ms
-        img = pix.convertToFormat(QtGui.QImage.Format_ARGB32)
-        v = qimage2ndarray.rgb_view(img)
+        # torn frame from the shared memory - it is read (and warped) again whole
+        if not self.frame_valid():
 
-        # TODO some further optimalization? this is about 30ms (with INTER_LINEAR)s...
-        image_np = cv2.remap(v, self.map_x, self.map_y, cv2.INTER_LINEAR)
+            self.warper.invalidate()
+            return
 
-        # this is about 3ms
-        height, width, channel = image_np.shape
-        bytesPerLine = 3 * width
-        image = QtGui.QPixmap.fromImage(QtGui.QImage(
-            image_np.data, width, height, bytesPerLine, QtGui.QImage.Format_RGB888))
+        height, width, channel = out.shape
+        image = QtGui.QPixmap.fromImage(QtGui.QImage(out.data, width, height, 4 * width, QtGui.QImage.Format_RGB32))
 
         self.pix_label.setPixmap(image)
         self.update()
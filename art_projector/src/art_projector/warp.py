@@ -0,0 +1,229 @@
+import os
+import struct
+import cv2
+import numpy as np
+
+
+# header of cached maps: magic, version, width, height, map format, homography (row-major)
+MAPS_MAGIC = b"ARTMAPS\0"
+MAPS_VERSION = 1
+MAPS_HEADER = struct.Struct("<8sIIIi9d")
+MAPS_HEADER_SIZE = 128  # maps start aligned after the header
+
+
+def homography_maps(m, width, height):
+    """Returns (map_x, map_y) for cv2.remap - for each projector pixel, position in the scene image given by inverse
+    of homography m (scene -> projector)."""
+
+    m = np.asarray(np.linalg.inv(m))
+
+    # all pixels at once
+    x, y = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+
+    w = m[2, 0] * x + m[2, 1] * y + m[2, 2]
+
+    map_x = ((m[0, 0] * x + m[0, 1] * y + m[0, 2]) / w).astype(np.float32)
+    map_y = ((m[1, 0] * x + m[1, 1] * y + m[1, 2]) / w).astype(np.float32)
+
+    return map_x, map_y
+
+
+def save_maps(path, m, width, height, maps):
+    """Stores maps (CV_16SC2 + CV_16UC1, as returned by cv2.convertMaps) in raw format for load_maps."""
+
+    map1, map2 = maps
+
+    header = MAPS_HEADER.pack(MAPS_MAGIC, MAPS_VERSION, width, height, cv2.CV_16SC2,
+                              *np.asarray(m, dtype=np.float64).flatten())
+
+    # file is replaced at once, so that a running projector never sees partially written maps
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "wb") as f:
+
+        f.write(header.ljust(MAPS_HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(map1, dtype=np.int16).tobytes())
+        f.write(np.ascontiguousarray(map2, dtype=np.uint16).tobytes())
+
+    os.rename(tmp_path, path)
+
+
+def load_maps(path, m, width, height):
+    """Returns maps stored by save_maps, memory-mapped (without copying), or None if there are no maps for given
+    homography and resolution."""
+
+    try:
+
+        with open(path, "rb") as f:
+            header = f.read(MAPS_HEADER.size)
+
+        if len(header) != MAPS_HEADER.size:
+            return None
+
+        fields = MAPS_HEADER.unpack(header)
+
+        if fields[:5] != (MAPS_MAGIC, MAPS_VERSION, width, height, cv2.CV_16SC2):
+            return None
+
+        if not np.allclose(fields[5:], np.asarray(m, dtype=np.float64).flatten(), rtol=1e-12, atol=0.0):
+            return None
+
+        if os.path.getsize(path) != MAPS_HEADER_SIZE + width * height * 6:
+            return None
+
+        # copy-on-write, file is never modified
+        map1 = np.memmap(path, dtype=np.int16, mode="c", offset=MAPS_HEADER_SIZE, shape=(height, width, 2))
+        map2 = np.memmap(path, dtype=np.uint16, mode="c", offset=MAPS_HEADER_SIZE + width * height * 4,
+                         shape=(height, width))
+
+    except (IOError, OSError, ValueError):
+        return None
+
+    return map1, map2
+
+
+def dirty_rect(prev, cur):
+    """Returns bounding box (x0, y0, x1, y1) of pixels which differ between two images (2D arrays) or None."""
+
+    diff = prev != cur
+    rows = np.flatnonzero(diff.any(axis=1))
+
+    if rows.size == 0:
+        return None
+
+    cols = np.flatnonzero(diff[rows[0]:rows[-1] + 1].any(axis=0))
+
+    return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+
+class Warper(object):
+
+    """Warps scene images (HxWx4 uint8 arrays) to the projector using homography m (scene -> projector).
+
+        method: 'perspective' (cv2.warpPerspective) or 'remap' (cv2.remap with precomputed maps)
+        interpolation: cv2.INTER_LINEAR or cv2.INTER_NEAREST
+        dirty_roi: only part of the output corresponding to changed pixels of the scene is warped
+
+        Output buffer is reused between frames, warp() returns None when there is nothing new to show.
+
+    """
+
+    # changed part of the scene is grown by interpolation support (in scene pixels) before it is projected,
+    # margin (in output pixels) covers rounding
+    roi_support = 1
+    roi_margin = 1
+
+    def __init__(self, m, width, height, method="perspective", interpolation=cv2.INTER_LINEAR, dirty_roi=True,
+                 maps=None):
+
+        if method not in ("perspective", "remap"):
+            raise ValueError("Unknown warp method: " + str(method))
+
+        self.m = np.asarray(m, dtype=np.float64)
+        self.m_inv = np.linalg.inv(self.m)
+        self.width = width
+        self.height = height
+        self.method = method
+        self.interpolation = interpolation
+        self.dirty_roi = dirty_roi
+
+        self.maps = maps
+
+        if self.method == "remap" and self.maps is None:
+            self.maps = cv2.convertMaps(*homography_maps(self.m, width, height), dstmap1type=cv2.CV_16SC2)
+
+        self.out = np.zeros((height, width, 4), dtype=np.uint8)
+        self.prev = None
+
+    def invalidate(self):
+        """The next frame will be warped whole."""
+
+        self.prev = None
+
+    def out_rect(self, rect):
+        """Returns part of the output (x0, y0, x1, y1) affected by given part of the scene image or None
+        when it is not visible."""
+
+        x0, y0, x1, y1 = rect
+        x0, y0, x1, y1 = x0 - self.roi_support, y0 - self.roi_support, x1 + self.roi_support, y1 + self.roi_support
+        corners = np.array([[x0, y0, 1.0], [x1, y0, 1.0], [x0, y1, 1.0], [x1, y1, 1.0]]).dot(self.m.T)
+
+        # (part of) the region is behind the projector - just warp everything
+        if np.any(corners[:, 2] <= 0):
+            return 0, 0, self.width, self.height
+
+        corners = corners[:, :2] / corners[:, 2:]
+
+        x0 = max(int(np.floor(corners[:, 0].min())) - self.roi_margin, 0)
+        y0 = max(int(np.floor(corners[:, 1].min())) - self.roi_margin, 0)
+        x1 = min(int(np.ceil(corners[:, 0].max())) + self.roi_margin, self.width)
+        y1 = min(int(np.ceil(corners[:, 1].max())) + self.roi_margin, self.height)
+
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        return x0, y0, x1, y1
+
+    def _warp_rect(self, img, rect):
+
+        x0, y0, x1, y1 = rect
+
+        if self.method == "remap":
+
+            map1, map2 = self.maps
+
+            if rect == (0, 0, self.width, self.height):
+                cv2.remap(img, map1, map2, self.interpolation, dst=self.out)
+            else:
+                self.out[y0:y1, x0:x1] = cv2.remap(img, map1[y0:y1, x0:x1], map2[y0:y1, x0:x1],
+                                                   self.interpolation)
+            return
+
+        # inverse map shifted to the output region: output (x, y) -> scene pixel
+        m = self.m_inv.dot(np.array([[1.0, 0.0, x0], [0.0, 1.0, y0], [0.0, 0.0, 1.0]]))
+        flags = self.interpolation | cv2.WARP_INVERSE_MAP
+
+        if rect == (0, 0, self.width, self.height):
+            cv2.warpPerspective(img, m, (self.width, self.height), dst=self.out, flags=flags)
+        else:
+            self.out[y0:y1, x0:x1] = cv2.warpPerspective(img, m, (x1 - x0, y1 - y0), flags=flags)
+
+    def warp(self, img, rect=None):
+        """Warps the scene image, returns the output buffer or None if the output did not change.
+
+            rect: changed part of the scene image (x0, y0, x1, y1), when not given, it is found by comparing
+            with the previous image (if dirty_roi is enabled)
+
+        """
+
+        full = (0, 0, self.width, self.height)
+
+        if not self.dirty_roi:
+
+            self._warp_rect(img, full)
+            return self.out
+
+        # pixels are compared as 32 bit values
+        cur = img.view(np.uint32).reshape(img.shape[:2])
+
+        if self.prev is None or self.prev.shape != cur.shape:
+
+            self.prev = cur.copy()
+            self._warp_rect(img, full)
+            return self.out
+
+        if rect is None:
+            rect = dirty_rect(self.prev, cur)
+
+        if rect is None:
+            return None
+
+        np.copyto(self.prev, cur)
+
+        out_rect = self.out_rect(rect)
+
+        if out_rect is None:
+            return None
+
+        self._warp_rect(img, out_rect)
+        return self.out
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import unittest
+import cv2
+import numpy as np
+from art_projector.warp import Warper
+
+
+class TestWarper(unittest.TestCase):
+
+    def setUp(self):
+
+        # magnifying homography with perspective (scene 160x120 -> projector 640x480)
+        self.m = np.array([[3.5, 0.3, 20.0], [-0.2, 3.2, 15.0], [0.0004, 0.0002, 1.0]])
+        self.width = 640
+        self.height = 480
+
+        rnd = np.random.RandomState(0)
+        self.img = rnd.randint(0, 256, (120, 160, 4)).astype(np.uint8)
+
+    def check_roi(self, method, interpolation, rect):
+
+        warper = Warper(self.m, self.width, self.height, method, interpolation)
+        full = Warper(self.m, self.width, self.height, method, interpolation, dirty_roi=False)
+
+        warper.warp(self.img)
+
+        img = self.img.copy()
+        x0, y0, x1, y1 = rect
+        img[y0:y1, x0:x1] = 255 - img[y0:y1, x0:x1]
+
+        out = warper.warp(img)
+
+        self.assertIsNotNone(out)
+        self.assertTrue(np.array_equal(out, full.warp(img)), "ROI warp differs from full warp")
+
+    def test_roi_equals_full_warp(self):
+
+        for method in ("perspective", "remap"):
+            for interpolation in (cv2.INTER_LINEAR, cv2.INTER_NEAREST):
+                for rect in ((50, 40, 51, 41), (0, 0, 10, 5), (100, 60, 160, 120), (70, 20, 90, 22)):
+                    self.check_roi(method, interpolation, rect)
+
+    def test_no_change(self):
+
+        warper = Warper(self.m, self.width, self.height)
+        warper.warp(self.img)
+
+        self.assertIsNone(warper.warp(self.img.copy()))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""Offline benchmark of art_simple_tracker fusion - does not need ROS master, DB or TF.
+
+Replays synthetic (or recorded) detections through the fusion code of ArtSimpleTracker with stubbed TF and
+reports latency percentiles of processing one detection message, pruning and making a snapshot, CPU time
+and memory per object.
+
+Examples:
+
+rosrun art_simple_tracker benchmark.py --objects 20 --cameras 4 --rate 30 --duration 60
+rosrun art_simple_tracker benchmark.py --mode kalman
+rosrun art_simple_tracker benchmark.py --bag detections.bag --tf kinect_1:0.5,0,0
+"""
+
+import argparse
+import random
+import resource
+import time
+import numpy as np
+import rospy
+from art_msgs.msg import InstancesArray, ObjInstance, ObjectType
+from shape_msgs.msg import SolidPrimitive
+from art_simple_tracker.tracker import ArtSimpleTracker
+
+
+class StaticTf(object):
+
+    """Stub of tf.TransformListener with fixed transforms (from camera frames to the target frame)."""
+
+    def __init__(self, transforms):
+
+        self.transforms = transforms
+
+    def waitForTransform(self, target_frame, source_frame, time, timeout):
+
+        pass
+
+    def lookupTransform(self, target_frame, source_frame, time):
+
+        return self.transforms.get(source_frame, ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0)))
+
+
+class FakeObjectTypes(object):
+
+    """Stub of ObjectTypeCache, every object type is known."""
+
+    def get(self, names):
+
+        types = {}
+
+        for name in set(names):
+
+            ot = ObjectType()
+            ot.name = name
+            ot.bbox.type = SolidPrimitive.BOX
+            ot.bbox.dimensions = [0.05, 0.05, 0.1]
+            types[name] = ot
+
+        return types
+
+
+class BenchmarkTracker(ArtSimpleTracker):
+
+    """ArtSimpleTracker without ROS communication (no topics, services, timers or threads)."""
+
+    def __init__(self, args, tfl):
+
+        # parameters not given here have the same defaults as in the node
+        params = {"~mode": args.mode, "~associate": args.associate, "~association_gate": args.gate}
+
+        self.setup("marker", tfl, [1.5, 0.7], FakeObjectTypes(), lambda name, default=None: params.get(name, default))
+
+
+def synthetic_stream(args):
+    """Returns InstancesArray messages of all cameras ordered by time (objects are static and noisy) and transforms
+    of the cameras."""
+
+    rnd = random.Random(args.seed)
+
+    cameras = []
+    transforms = {}
+
+    for idx in range(args.cameras):
+
+        frame_id = "kinect_" + str(idx + 1)
+        pos = (rnd.uniform(0.0, 1.5), rnd.uniform(0.0, 0.7), 1.0)
+
+        cameras.append((frame_id, pos, rnd.uniform(0.0, 1.0 / args.rate)))
+        transforms[frame_id] = (pos, (0.0, 0.0, 0.0, 1.0))
+
+    objects = [(str(idx), (rnd.uniform(0.0, 1.5), rnd.uniform(0.0, 0.7), 0.05)) for idx in range(args.objects)]
+
+    msgs = []
+
+    for frame_id, cam_pos, offset in cameras:
+
+        t = offset
+
+        while t < args.duration:
+
+            ia = InstancesArray()
+            ia.header.frame_id = frame_id
+            ia.header.stamp = rospy.Time.from_sec(t + 1.0)
+
+            for object_id, obj_pos in objects:
+
+                inst = ObjInstance()
+                inst.object_id = object_id
+                inst.object_type = "benchmark_type"
+                inst.pose.position.x = obj_pos[0] - cam_pos[0] + rnd.gauss(0.0, args.noise)
+                inst.pose.position.y = obj_pos[1] - cam_pos[1] + rnd.gauss(0.0, args.noise)
+                inst.pose.position.z = obj_pos[2] - cam_pos[2] + rnd.gauss(0.0, args.noise)
+                inst.pose.orientation.w = 1.0
+                ia.instances.append(inst)
+
+            msgs.append(ia)
+            t += 1.0 / args.rate
+
+    msgs.sort(key=lambda m: m.header.stamp)
+    return msgs, transforms
+
+
+def bag_stream(args):
+
+    import rosbag
+
+    transforms = {}
+
+    for tf_arg in args.tf:
+
+        frame_id, values = tf_arg.split(":")
+        values = [float(v) for v in values.split(",")]
+        transforms[frame_id] = (values[:3], values[3:7] if len(values) == 7 else (0.0, 0.0, 0.0, 1.0))
+
+    with rosbag.Bag(args.bag) as bag:
+        msgs = [msg for _, msg, _ in bag.read_messages(topics=[args.topic])]
+
+    return msgs, transforms
+
+
+def report(name, values):
+
+    if not values:
+        print(name + ": no data")
+        return
+
+    ms = np.array(values) * 1000.0
+    print("%-10s n=%-7d mean=%.3f ms  p50=%.3f ms  p90=%.3f ms  p99=%.3f ms  max=%.3f ms" % (
+        name, len(ms), ms.mean(), np.percentile(ms, 50), np.percentile(ms, 90), np.percentile(ms, 99), ms.max()))
+
+
+def object_bytes(obj):
+    """Returns size of NumPy arrays kept by the object (measurement buffers or state of its Kalman filter)."""
+
+    total = 0
+
+    for holder in list(obj.meas.itervalues()) + [obj, getattr(obj, "kf", None)]:
+
+        if holder is None:
+            continue
+
+        for value in vars(holder).itervalues():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+
+    return total
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Offline benchmark of art_simple_tracker fusion.")
+    parser.add_argument("--objects", type=int, default=10)
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=30.0, help="detection rate of each camera (Hz)")
+    parser.add_argument("--duration", type=float, default=30.0, help="simulated time (s)")
+    parser.add_argument("--noise", type=float, default=0.01, help="std of position noise (m)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", default="static", choices=["static", "kalman"])
+    parser.add_argument("--associate", action="store_true")
+    parser.add_argument("--gate", type=float, default=16.27, help="association gate (squared Mahalanobis distance)")
+    parser.add_argument("--bag", help="replay detections from bag instead of synthetic ones")
+    parser.add_argument("--topic", default="/art/object_detector/object")
+    parser.add_argument("--tf", action="append", default=[],
+                        help="transform of camera frame for bag replay: frame_id:x,y,z[,qx,qy,qz,qw]")
+    args = parser.parse_args()
+
+    if args.associate and args.mode != "kalman":
+        parser.error("association is available only in kalman mode")
+
+    if args.bag:
+        msgs, transforms = bag_stream(args)
+    else:
+        msgs, transforms = synthetic_stream(args)
+
+    if not msgs:
+        print("No detections to replay.")
+        return
+
+    tracker = BenchmarkTracker(args, StaticTf(transforms))
+
+    prune_period = rospy.Duration(1.0)
+    publish_period = rospy.Duration(0.1)
+
+    last_prune = msgs[0].header.stamp
+    last_snapshot = msgs[0].header.stamp
+
+    lat_process = []
+    lat_prune = []
+    lat_snapshot = []
+
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_start = time.clock()
+    wall_start = time.time()
+
+    # simulated time is driven by stamps of the detections
+    for msg in msgs:
+
+        now = msg.header.stamp
+
+        t = time.time()
+        tracker.process(msg)
+        lat_process.append(time.time() - t)
+
+        if now - last_prune >= prune_period:
+
+            last_prune = now
+            t = time.time()
+            tracker.prune(now)
+            lat_prune.append(time.time() - t)
+
+        if now - last_snapshot >= publish_period:
+
+            last_snapshot = now
+            t = time.time()
+            tracker.make_snapshot(now)
+            lat_snapshot.append(time.time() - t)
+
+    cpu = time.clock() - cpu_start
+    wall = time.time() - wall_start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start
+
+    instances = sum(len(msg.instances) for msg in msgs)
+    objects = max(len(tracker.objects), 1)
+
+    print("mode: %s%s, messages: %d, instances: %d, objects: %d" % (
+        args.mode, " (associate)" if args.associate else "", len(msgs), instances, len(tracker.objects)))
+    report("process", lat_process)
+    report("prune", lat_prune)
+    report("snapshot", lat_snapshot)
+    print("cpu time: %.3f s (%.1f us per instance), wall time: %.3f s, %.0f messages/s" % (
+        cpu, cpu / max(instances, 1) * 1e6, wall, len(msgs) / wall))
+    print("memory: %.1f kB arrays per object, max RSS growth %.1f kB per object" % (
+        sum(object_bytes(obj) for obj in tracker.objects.itervalues()) / 1024.0 / objects, float(rss) / objects))
+
+
+if __name__ == '__main__':
+
+    main()
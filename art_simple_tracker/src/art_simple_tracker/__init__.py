@@ -1 +1,2 @@
 from tracker import ArtSimpleTracker
+from delta_client import InstancesDeltaClient
@@ -0,0 +1,85 @@
+import rospy
+import threading
+from art_simple_tracker.msg import InstancesDelta
+from art_simple_tracker.srv import GetInstances
+
+
+class InstancesDeltaClient(object):
+
+    """Keeps state of tracked objects using delta stream of the tracker.
+
+        When a delta is missed (there is a gap in sequence numbers), the whole state is fetched again.
+        Optional callback is called with (instances, new_objects, lost_objects) for each applied change,
+        instances are only the added or updated ones.
+
+    """
+
+    def __init__(self, cb=None):
+
+        self.cb = cb
+        self.lock = threading.Lock()
+        self.seq = None
+        self.objects = {}
+
+        self.get_instances_srv = rospy.ServiceProxy('/art/object_detector/object_filtered/get', GetInstances)
+        self.sub = rospy.Subscriber('/art/object_detector/object_filtered/delta', InstancesDelta, self.delta_cb,
+                                    queue_size=10)
+
+    def get_objects(self):
+        """Returns dictionary (object_id -> ObjInstance) of currently tracked objects."""
+
+        with self.lock:
+            return dict(self.objects)
+
+    def resync(self):
+
+        try:
+            resp = self.get_instances_srv()
+        except rospy.ServiceException as e:
+            rospy.logerr("Service call failed: " + str(e))
+            return False
+
+        objects = {inst.object_id: inst for inst in resp.instances.instances}
+
+        with self.lock:
+
+            new_objects = [object_id for object_id in objects if object_id not in self.objects]
+            lost_objects = [object_id for object_id in self.objects if object_id not in objects]
+
+            self.objects = objects
+            self.seq = resp.seq
+
+        if self.cb is not None:
+            self.cb(resp.instances.instances, new_objects, lost_objects)
+
+        return True
+
+    def delta_cb(self, msg):
+
+        with self.lock:
+
+            in_sync = self.seq is not None and msg.seq == self.seq + 1
+            # seq starting from 1 again means that the tracker was restarted
+            old = self.seq is not None and 1 < msg.seq <= self.seq
+
+            if in_sync:
+
+                for inst in msg.instances:
+                    self.objects[inst.object_id] = inst
+
+                for object_id in msg.lost_objects:
+                    self.objects.pop(object_id, None)
+
+                self.seq = msg.seq
+
+        if old:
+            return
+
+        if not in_sync:
+
+            rospy.logdebug("Delta stream out of sync, fetching all objects.")
+            self.resync()
+            return
+
+        if self.cb is not None:
+            self.cb(msg.instances, msg.new_objects, msg.lost_objects)
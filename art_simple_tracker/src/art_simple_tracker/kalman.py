@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class ConstantVelocityKalman(object):
+
+    """Kalman filter of 3D position with constant velocity model.
+
+        State is [x, y, z, vx, vy, vz], only the position is measured. Unknown accelerations are covered by
+        process noise (accel_noise is its standard deviation in m/s^2).
+
+    """
+
+    def __init__(self, pos, meas_noise, accel_noise=0.5, init_vel_noise=0.5):
+
+        self.x = np.zeros(6)
+        self.x[:3] = pos
+
+        self.P = np.diag([meas_noise ** 2] * 3 + [init_vel_noise ** 2] * 3)
+        self.accel_noise = accel_noise
+
+        self.H = np.hstack((np.eye(3), np.zeros((3, 3))))
+
+    @property
+    def pos(self):
+
+        return self.x[:3]
+
+    @property
+    def vel(self):
+
+        return self.x[3:]
+
+    def predict(self, dt):
+
+        if dt <= 0.0:
+            return
+
+        F = np.eye(6)
+        F[:3, 3:] = np.eye(3) * dt
+
+        # piecewise constant white acceleration
+        g = np.array([dt ** 2 / 2.0, dt])
+        Q = np.kron(np.outer(g, g), np.eye(3)) * (self.accel_noise ** 2)
+
+        self.x = F.dot(self.x)
+        self.P = F.dot(self.P).dot(F.T) + Q
+
+    def _innovation(self, pos, meas_noise):
+
+        y = np.asarray(pos) - self.H.dot(self.x)
+        S = self.H.dot(self.P).dot(self.H.T) + np.eye(3) * meas_noise ** 2
+
+        return y, S
+
+    def mahalanobis_sq(self, pos, meas_noise):
+        """Squared Mahalanobis distance of the measured position from the predicted one (for gating)."""
+
+        y, S = self._innovation(pos, meas_noise)
+        return float(y.dot(np.linalg.solve(S, y)))
+
+    def update(self, pos, meas_noise):
+
+        y, S = self._innovation(pos, meas_noise)
+        K = self.P.dot(self.H.T).dot(np.linalg.inv(S))
+
+        self.x = self.x + K.dot(y)
+        self.P = (np.eye(6) - K.dot(self.H)).dot(self.P)
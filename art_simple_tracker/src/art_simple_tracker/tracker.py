@@ -1,16 +1,20 @@
 #! /usr/bin/env python
 import rospy
-from art_msgs.msg import InstancesArray, ObjInstance, KeyValue
+from art_msgs.msg import InstancesArray, ObjInstance, KeyValue, ObjectType
 from art_msgs.srv import ObjectFlagSetResponse, ObjectFlagSet, ObjectFlagClear, ObjectFlagClearResponse
+from art_simple_tracker.msg import InstancesDelta
+from art_simple_tracker.srv import GetInstances, GetInstancesResponse
 from std_srvs.srv import Empty, EmptyResponse
 import tf
-from geometry_msgs.msg import PoseStamped
 import numpy as np
-from scipy.spatial import distance
 import threading
+from collections import deque
+from copy import copy
 from tf import transformations
-from math import cos, sin, atan2
-from art_utils import ArtApiHelper, array_from_param
+from math import atan2, acos
+from art_utils import array_from_param
+from art_helpers import ArtDbHelper
+from art_simple_tracker.kalman import ConstantVelocityKalman
 from shape_msgs.msg import SolidPrimitive
 
 
@@ -25,13 +29,107 @@ def a2q(q, arr):
     q.w = arr[3]
 
 
+def transform_instances(trans, rot, instances):
+    """Transforms poses of all instances (one camera frame) by given translation and rotation (quaternion) at once.
+
+        Returns (dist, pos, rpy) arrays - distances from the sensor (in the source frame), transformed positions and
+        Euler angles of transformed orientations.
+
+    """
+
+    pos = np.array([(i.pose.position.x, i.pose.position.y, i.pose.position.z) for i in instances], dtype=float)
+    q = np.array([q2a(i.pose.orientation) for i in instances], dtype=float)
+
+    dist = np.linalg.norm(pos, axis=1)
+
+    pos = pos.dot(transformations.quaternion_matrix(rot)[:3, :3].T) + trans
+
+    # rot * q (Hamilton product) for all orientations, quaternions are x, y, z, w
+    x1, y1, z1, w1 = rot
+    x2, y2, z2, w2 = q.T
+
+    x = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+    y = w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2
+    z = w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2
+    w = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+
+    # same as transformations.euler_from_quaternion (static xyz axes) for unit quaternions
+    rpy = np.column_stack((np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y)),
+                           np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0)),
+                           np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))))
+
+    return dist, pos, rpy
+
+
+class MeasBuffer(object):
+
+    """Ring buffer of measurements from one sensor frame, kept in preallocated NumPy arrays.
+
+        For each measurement, there is a timestamp (in seconds), distance from the sensor, position and sin/cos of
+        roll, pitch and yaw. When the buffer is full, the oldest measurement is overwritten.
+
+    """
+
+    def __init__(self, capacity=200):
+
+        self.capacity = capacity
+        self.stamp = np.zeros(capacity)
+        self.dist = np.zeros(capacity)
+        self.pos = np.zeros((capacity, 3))
+        self.rpy_cos = np.zeros((capacity, 3))
+        self.rpy_sin = np.zeros((capacity, 3))
+
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+
+        return self.count
+
+    def _indices(self):
+
+        # from the oldest to the newest
+        return (self.start + np.arange(self.count)) % self.capacity
+
+    def append(self, stamp, dist, pos, rpy):
+
+        if self.count < self.capacity:
+            idx = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            idx = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        self.stamp[idx] = stamp
+        self.dist[idx] = dist
+        self.pos[idx] = pos
+        self.rpy_cos[idx] = np.cos(rpy)
+        self.rpy_sin[idx] = np.sin(rpy)
+
+    def prune(self, min_stamp):
+        """Removes measurements older than min_stamp, kept ones are moved to the beginning of the arrays."""
+
+        idx = self._indices()
+        keep = idx[self.stamp[idx] >= min_stamp]
+
+        for arr in (self.stamp, self.dist, self.pos, self.rpy_cos, self.rpy_sin):
+            arr[:len(keep)] = arr[keep]
+
+        self.start = 0
+        self.count = len(keep)
+
+    def data(self):
+        """Returns (dist, pos, rpy_cos, rpy_sin) ordered from the oldest to the newest measurement."""
+
+        idx = self._indices()
+        return self.dist[idx], self.pos[idx], self.rpy_cos[idx], self.rpy_sin[idx]
+
+
 class TrackedObject:
-    def __init__(self, target_frame, tfl, object_id, object_type):
+    def __init__(self, object_id, object_type):
 
         self.object_id = object_id
         self.object_type = object_type
-        self.tfl = tfl
-        self.target_frame = target_frame
         self.max_dist = 2.0
         self.min_dist = 0.05
         self.min_meas_cnt = 5
@@ -41,7 +139,8 @@ class TrackedObject:
         self.meas = {}
         self.flags = {}
 
-    def add_meas(self, ps):
+    def add_meas(self, frame_id, stamp, dist, pos, rpy):
+        """Adds measurement already transformed to the target frame (see transform_instances)."""
 
         if self.lost:
 
@@ -49,122 +148,100 @@ class TrackedObject:
 
         self.lost = False
 
-        dist = distance.euclidean((0, 0, 0), (ps.pose.position.x, ps.pose.position.y, ps.pose.position.z))
-
         if dist > self.max_dist or dist < self.min_dist:
-            rospy.logdebug("Object " + self.object_id + " seen by " + ps.header.frame_id +
+            rospy.logdebug("Object " + self.object_id + " seen by " + frame_id +
                            " is too far (or too close): " + str(dist))
             return
 
-        try:
-
-            pps = self.transform(ps)
-
-        except tf.Exception as e:
-
-            rospy.logwarn("Transform at " + str(ps.header.stamp.to_sec()) + " between " + self.target_frame +
-                          " and " + ps.header.frame_id + " not available: " + str(e))
-            return
-
-        if ps.header.frame_id not in self.meas:
-            self.meas[ps.header.frame_id] = []
+        if frame_id not in self.meas:
+            self.meas[frame_id] = MeasBuffer()
 
-        self.meas[ps.header.frame_id].append([dist, self.transform(pps)])
+        self.meas[frame_id].append(stamp.to_sec(), dist, pos, rpy)
 
     def prune_meas(self, now, max_age):
 
         frames_to_delete = []
+        min_stamp = (now - max_age).to_sec()
 
         # delete old measurements
-        for frame_id, val in self.meas.iteritems():
-
-            idx_to_delete = []
+        for frame_id, buff in self.meas.iteritems():
 
-            for idx in range(0, len(val)):
+            buff.prune(min_stamp)
 
-                if (now - val[idx][1].header.stamp) > max_age:
-                    idx_to_delete.append(idx)
-
-            val = [x for i, x in enumerate(val) if i not in idx_to_delete]
-
-            if len(val) == 0:
+            if len(buff) == 0:
                 frames_to_delete.append(frame_id)
 
-            self.meas[frame_id] = val
-
         for frame_id in frames_to_delete:
             del self.meas[frame_id]
 
-    def inst(self, table_size, ground_objects_on_table=False, ground_bb_axis=SolidPrimitive.BOX_Z,
-             yaw_only_on_table=False):
+    def remove_frame(self, frame_id):
 
-        inst = ObjInstance()
-        inst.object_id = self.object_id
-        inst.object_type = self.object_type.name
-
-        w = []
+        try:
+            del self.meas[frame_id]
+        except KeyError:
+            pass
 
-        px = []
-        py = []
-        pz = []
+    def fused(self):
+        """Returns fused position (array) and roll, pitch, yaw - or None if there are not enough measurements."""
 
-        r = []
-        p = []
-        y = []
+        w = []
+        pos = []
+        rpy_cos = []
+        rpy_sin = []
 
-        for frame_id, val in self.meas.iteritems():
+        for frame_id, buff in self.meas.iteritems():
 
-            if len(val) < 2:
+            if len(buff) < 2:
                 continue
 
-            for idx in range(0, len(val)):
+            dist, p, c, s = buff.data()
 
-                v = val[idx]
+            # distance normalized to 0, 1
+            d = (dist - self.min_dist) / (self.max_dist - self.min_dist)
 
-                # distance normalized to 0, 1
-                d = (v[0] - self.min_dist) / (self.max_dist - self.min_dist)
+            # weight based on distance from object to sensor (0, 1)
+            # newer detections are more interesting (0.5, 1)
+            w.append((1.0 - d) ** 2 * np.linspace(0.5, 1.0, len(buff)))
 
-                # weight based on distance from object to sensor
-                w_dist = (1.0 - d) ** 2  # (0, 1)
+            pos.append(p)
+            rpy_cos.append(c)
+            rpy_sin.append(s)
 
-                # newer detections are more interesting
-                w_age = (float(idx) / (len(val) - 1)) / 2 + 0.5  # (0.5, 1)
+        if sum(len(x) for x in w) < self.min_meas_cnt:
+            return None
 
-                w.append(w_dist * w_age)
+        w = np.concatenate(w)
 
-                px.append(v[1].pose.position.x)
-                py.append(v[1].pose.position.y)
-                pz.append(v[1].pose.position.z)
+        # one weighted average for position and orientation (sin/cos of angles) of all measurements
+        avg = np.average(np.hstack((np.concatenate(pos), np.concatenate(rpy_cos), np.concatenate(rpy_sin))),
+                         axis=0, weights=w)
 
-                rpy = transformations.euler_from_quaternion(q2a(v[1].pose.orientation))
+        return avg[:3], [atan2(avg[6 + i], avg[3 + i]) for i in range(3)]
 
-                r.append([cos(rpy[0]), sin(rpy[0])])
-                p.append([cos(rpy[1]), sin(rpy[1])])
-                y.append([cos(rpy[2]), sin(rpy[2])])
+    def inst(self, table_size, ground_objects_on_table=False, ground_bb_axis=SolidPrimitive.BOX_Z,
+             yaw_only_on_table=False):
 
-        if len(w) < self.min_meas_cnt:
+        fused = self.fused()
+
+        if fused is None:
             return None
 
-        inst.pose.position.x = np.average(px, weights=w)
-        inst.pose.position.y = np.average(py, weights=w)
+        pos, cur_rpy = fused
 
-        inst.on_table = 0 < inst.pose.position.x < table_size[0] and 0 < inst.pose.position.y < table_size[1]
-
-        ar = np.average(r, axis=0, weights=w)
-        ap = np.average(p, axis=0, weights=w)
-        ay = np.average(y, axis=0, weights=w)
+        inst = ObjInstance()
+        inst.object_id = self.object_id
+        inst.object_type = self.object_type.name
 
-        fr = atan2(ar[1], ar[0])
-        fp = atan2(ap[1], ap[0])
-        fy = atan2(ay[1], ay[0])
+        inst.pose.position.x = pos[0]
+        inst.pose.position.y = pos[1]
 
-        cur_rpy = [fr, fp, fy]
+        inst.on_table = 0 < inst.pose.position.x < table_size[0] and 0 < inst.pose.position.y < table_size[1]
 
         q_arr = transformations.quaternion_from_euler(*cur_rpy)
 
         # ground objects that are really sitting on the table (exclude those in the air)
-        if inst.on_table and ground_objects_on_table and np.average(
-                pz, weights=w) < self.object_type.bbox.dimensions[ground_bb_axis] / 2.0 + 0.1:
+        if inst.on_table and ground_objects_on_table and \
+                pos[2] < self.object_type.bbox.dimensions[ground_bb_axis] / 2.0 + 0.1:
             # TODO consider orientation!
             inst.pose.position.z = self.object_type.bbox.dimensions[ground_bb_axis] / 2.0
 
@@ -178,7 +255,7 @@ class TrackedObject:
                 q_arr = transformations.unit_vector(q_arr)
 
         else:
-            inst.pose.position.z = np.average(pz, weights=w)
+            inst.pose.position.z = pos[2]
 
         a2q(inst.pose.orientation, q_arr)
 
@@ -190,42 +267,271 @@ class TrackedObject:
 
         return inst
 
-    def transform(self, ps):
 
-        self.tfl.waitForTransform(
-            self.target_frame, ps.header.frame_id, ps.header.stamp, rospy.Duration(0.5))
+class KalmanTrackedObject(TrackedObject):
+
+    """Object tracked by constant velocity Kalman filter, suitable also for moving objects.
+
+        Measurements from all sensors update one filter, so memory and computation per object are constant.
+        meas_noise is standard deviation of position measured 1 m from the sensor (it grows with the distance).
+        Orientation is exponentially smoothed (sin/cos of angles) with orientation_alpha.
+
+    """
+
+    def __init__(self, object_id, object_type, accel_noise=0.5, meas_noise=0.01, orientation_alpha=0.3):
+
+        TrackedObject.__init__(self, object_id, object_type)
+
+        self.accel_noise = accel_noise
+        self.meas_noise = meas_noise
+        self.orientation_alpha = orientation_alpha
+
+        self.kf = None
+        self.stamp = None
+        self.last_update = None
+        self.updates = 0
+        self.rpy_cs = None
+
+        # object created by association is not published until it is confirmed by enough measurements
+        self.tentative = False
+        self.created = None
+
+    def _noise(self, dist):
+
+        return self.meas_noise * max(dist, 0.5)
+
+    def predict_to(self, stamp):
+
+        if self.kf is None:
+            return
+
+        if stamp > self.stamp:
+
+            self.kf.predict((stamp - self.stamp).to_sec())
+            self.stamp = stamp
 
-        return self.tfl.transformPose(self.target_frame, ps)
+    def distance_sq(self, dist, pos):
+        """Squared Mahalanobis distance of measured position from the (predicted) state of the object."""
+
+        if self.kf is None:
+            return float("inf")
+
+        return self.kf.mahalanobis_sq(pos, self._noise(dist))
+
+    def add_meas(self, frame_id, stamp, dist, pos, rpy):
+
+        if self.lost:
+
+            self.new = True
+
+        self.lost = False
+
+        if dist > self.max_dist or dist < self.min_dist:
+            rospy.logdebug("Object " + self.object_id + " seen by " + frame_id +
+                           " is too far (or too close): " + str(dist))
+            return
+
+        rpy_cs = np.hstack((np.cos(rpy), np.sin(rpy)))
+
+        if self.kf is None:
+
+            self.kf = ConstantVelocityKalman(pos, self._noise(dist), self.accel_noise)
+            self.stamp = stamp
+            self.rpy_cs = rpy_cs
+
+        else:
+
+            # measurements from different sensors might come slightly out of order
+            self.predict_to(stamp)
+            self.kf.update(pos, self._noise(dist))
+            self.rpy_cs = (1.0 - self.orientation_alpha) * self.rpy_cs + self.orientation_alpha * rpy_cs
+
+        self.updates += 1
+
+        if self.last_update is None or stamp > self.last_update:
+            self.last_update = stamp
+
+    def prune_meas(self, now, max_age):
+
+        # object which is not seen for some time starts from scratch
+        if self.kf is not None and now - self.last_update > max_age:
+
+            self.kf = None
+            self.stamp = None
+            self.last_update = None
+            self.updates = 0
+
+    def remove_frame(self, frame_id):
+
+        pass
+
+    def fused(self):
+
+        if self.kf is None or self.updates < self.min_meas_cnt or self.tentative:
+            return None
+
+        return self.kf.pos, [atan2(self.rpy_cs[3 + i], self.rpy_cs[i]) for i in range(3)]
+
+
+class ObjectTypeCache(object):
+
+    """Object types fetched from art_db. Unknown types are remembered for negative_ttl (seconds).
+
+        Cached types are updated when art_db announces that an object type was stored.
+
+    """
+
+    def __init__(self, db, negative_ttl=10.0):
+
+        self.db = db
+        self.negative_ttl = rospy.Duration(negative_ttl)
+        self.known = {}
+        self.unknown = {}  # name -> time when it should be asked for again
+        self.lock = threading.Lock()
+
+        self.sub = rospy.Subscriber('/art/db/object_type/stored', ObjectType, self.stored_cb, queue_size=10)
+
+    def stored_cb(self, msg):
+
+        with self.lock:
+
+            self.known[msg.name] = msg
+            self.unknown.pop(msg.name, None)
+
+    def get(self, names):
+        """Returns dictionary (name -> ObjectType) of known object types from given names."""
+
+        now = rospy.Time.now()
+        types = {}
+        missing = []
+
+        with self.lock:
+
+            for name in set(names):
+
+                if name in self.known:
+                    types[name] = self.known[name]
+                elif name not in self.unknown or self.unknown[name] <= now:
+                    missing.append(name)
+
+        if not missing:
+            return types
+
+        found = self.db.get_object_types(missing)
+
+        # DB is not available - types will be asked for again next time
+        if found is None:
+            return types
+
+        with self.lock:
+
+            for name in missing:
+
+                if name in found:
+
+                    self.known[name] = found[name]
+                    types[name] = found[name]
+
+                else:
+
+                    rospy.logerr("Unknown object type: " + name)
+                    self.unknown[name] = now + self.negative_ttl
+
+        return types
+
+
+class WorkerTask(object):
+
+    """Function posted to the fusion worker, caller may wait for its result."""
+
+    def __init__(self, fn):
+
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+
+        # exception is raised in the caller (see wait), the worker has to keep running
+        try:
+            self.result = self.fn()
+        except Exception as e:
+            rospy.logerr("Tracker task failed: " + str(e))
+            self.error = e
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """Returns result of the function or raises its exception (rospy.ServiceException if it was not run
+        within timeout)."""
+
+        if not self.done.wait(timeout):
+            raise rospy.ServiceException("Tracker worker did not respond in time")
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
 
 
 # "tracking" of static objects
 class ArtSimpleTracker:
     def __init__(self, target_frame="marker"):
 
-        self.target_frame = target_frame
-        self.tfl = tf.TransformListener()
-        self.lock = threading.Lock()
+        tfl = tf.TransformListener()
         self.detection_enabled = True
         self.use_forearm_cams = False
-        self.table_size = array_from_param("/art/conf/table/size", float, 2, wait=True)
-        self.ground_objects_on_table = rospy.get_param("~ground_objects_on_table", False)
-        self.yaw_only_on_table = rospy.get_param("~yaw_only_on_table", False)
-        self.ground_bb_axis = rospy.get_param("~ground_bb_axis", SolidPrimitive.BOX_Z)
-        if self.ground_objects_on_table:
-            rospy.loginfo("Objects on table will be grounded.")
-        self.api = ArtApiHelper()
-        self.api.wait_for_db_api()
+        table_size = array_from_param("/art/conf/table/size", float, 2, wait=True)
+        self.db = ArtDbHelper()
+        self.db.wait_for_db_api()
+
+        self.setup(target_frame, tfl, table_size, ObjectTypeCache(self.db, rospy.get_param("~unknown_type_ttl", 10.0)))
+
+        self.prune_period = rospy.Duration(1.0)
+        self.publish_period = rospy.Duration(0.1)
+
+        # raw detections (deque operations are atomic, the oldest message is dropped when it is full)
+        self.queue = deque(maxlen=rospy.get_param("~queue_size", 50))
+        self.tasks = deque()
+        self.wake = threading.Event()
+        self.task_timeout = rospy.get_param("~task_timeout", 5.0)
+
+        # latest InstancesArray made by the worker, it is never modified once it is stored here
+        # worker makes a new one only after the previous one was consumed by timer_cb (so new / lost objects
+        # are always announced)
+        self.snapshot = None
+        self.consumed = None
+        self.published = None
+
+        # publish only when something changes (+ keepalive) instead of every period
+        self.publish_on_change = rospy.get_param("~publish_on_change", False)
+        self.change_position_threshold = rospy.get_param("~change_position_threshold", 0.005)
+        self.change_angle_threshold = rospy.get_param("~change_angle_threshold", 0.03)
+        self.keepalive_period = rospy.Duration(rospy.get_param("~keepalive_period", 1.0))
+
+        # state of objects as announced by the delta stream (only touched by timer_cb)
+        self.delta_seq = 0
+        self.delta_state = {}
+
+        # (seq, instances) - what clients of the delta stream should have, swapped atomically by timer_cb
+        self.delta_snapshot = (0, [])
 
-        self.meas_max_age = rospy.Duration(5.0)
-        self.prune_timer = rospy.Timer(rospy.Duration(1.0), self.prune_timer_cb)
-        self.objects = {}
         self.br = tf.TransformBroadcaster()
 
+        self.worker = threading.Thread(target=self.worker_loop)
+        self.worker.daemon = True
+        self.worker.start()
+
         self.sub = rospy.Subscriber(
             "/art/object_detector/object", InstancesArray, self.cb, queue_size=1)
         self.pub = rospy.Publisher(
             "/art/object_detector/object_filtered", InstancesArray, queue_size=1, latch=True)
-        self.timer = rospy.Timer(rospy.Duration(0.1), self.timer_cb)
+        self.delta_pub = rospy.Publisher(
+            "/art/object_detector/object_filtered/delta", InstancesDelta, queue_size=10)
+        self.srv_get_instances = rospy.Service('/art/object_detector/object_filtered/get', GetInstances,
+                                               self.srv_get_instances_cb)
+        self.timer = rospy.Timer(self.publish_period, self.timer_cb)
 
         self.srv_set_flag = rospy.Service('/art/object_detector/flag/set', ObjectFlagSet, self.srv_set_flag_cb)
         self.srv_clear_flag = rospy.Service('/art/object_detector/flag/clear', ObjectFlagClear, self.srv_clear_flag_cb)
@@ -242,6 +548,115 @@ class ArtSimpleTracker:
         self.srv_disable_detection = rospy.Service('/art/object_detector/all/disable', Empty,
                                                    self.srv_disable_detection_cb)
 
+    def setup(self, target_frame, tfl, table_size, object_types, get_param=rospy.get_param):
+        """Initializes the fusion (process, prune, make_snapshot) without any ROS communication.
+
+            tfl: tf.TransformListener (or anything with the same lookup methods)
+            object_types: ObjectTypeCache (or anything with its get method)
+            get_param: function returning value of (private) parameter or given default
+
+        """
+
+        self.target_frame = target_frame
+        self.tfl = tfl
+        self.table_size = table_size
+        self.ground_objects_on_table = get_param("~ground_objects_on_table", False)
+        self.yaw_only_on_table = get_param("~yaw_only_on_table", False)
+        self.ground_bb_axis = get_param("~ground_bb_axis", SolidPrimitive.BOX_Z)
+        if self.ground_objects_on_table:
+            rospy.loginfo("Objects on table will be grounded.")
+        self.object_types = object_types
+
+        self.meas_max_age = rospy.Duration(get_param("~meas_max_age", 5.0))
+
+        # static: weighted average of recent measurements, kalman: constant velocity Kalman filter per object
+        self.mode = get_param("~mode", "static")
+
+        if self.mode not in ("static", "kalman"):
+            raise ValueError("Unknown tracking mode: " + self.mode)
+
+        self.kalman_accel_noise = get_param("~kalman/accel_noise", 0.5)
+        self.kalman_meas_noise = get_param("~kalman/meas_noise", 0.01)
+        self.kalman_orientation_alpha = get_param("~kalman/orientation_alpha", 0.3)
+
+        # detections are matched to objects by position (and type), detector's object_id is ignored
+        self.associate = get_param("~associate", False)
+        self.association_gate = get_param("~association_gate", 16.27)  # chi2, 3 DOF, 99.9 %
+        self.confirm_hits = get_param("~confirm_hits", 10)
+        self.confirm_period = rospy.Duration(get_param("~confirm_period", 1.0))
+        self.next_object_id = 0
+
+        if self.associate and self.mode != "kalman":
+            rospy.logwarn("Association is available only in kalman mode, disabling it.")
+            self.associate = False
+
+        rospy.loginfo("Tracking mode: " + self.mode + (" (with association)" if self.associate else ""))
+
+        # objects are owned by the fusion worker thread, other threads only post tasks to it
+        self.objects = {}
+
+    def post(self, fn):
+        """Runs fn in the fusion worker thread. Returns WorkerTask which could be used to wait for the result."""
+
+        task = WorkerTask(fn)
+        self.tasks.append(task)
+        self.wake.set()
+        return task
+
+    def call(self, fn):
+        """Runs fn in the fusion worker thread and returns its result, raises its exception or
+        rospy.ServiceException if the worker does not run it within ~task_timeout."""
+
+        return self.post(fn).wait(self.task_timeout)
+
+    def worker_loop(self):
+
+        last_prune = rospy.Time.now()
+        last_snapshot = rospy.Time(0)
+
+        while not rospy.is_shutdown():
+
+            self.wake.wait(self.publish_period.to_sec())
+            self.wake.clear()
+
+            while self.tasks:
+                self.tasks.popleft().run()
+
+            # the worker is the only one fusing detections, it must not die on an error
+            while self.queue:
+
+                try:
+                    self.process(self.queue.popleft())
+                except Exception as e:
+                    rospy.logerr("Failed to process detections: " + str(e))
+
+            now = rospy.Time.now()
+
+            if now - last_prune >= self.prune_period:
+
+                last_prune = now
+
+                try:
+                    self.prune(now)
+                except Exception as e:
+                    rospy.logerr("Failed to prune tracked objects: " + str(e))
+
+            if now - last_snapshot >= self.publish_period and self.snapshot is self.consumed:
+
+                last_snapshot = now
+
+                try:
+                    self.snapshot = self.make_snapshot(now)
+                except Exception as e:
+                    rospy.logerr("Failed to make snapshot of tracked objects: " + str(e))
+
+    def remove_forearm_meas(self):
+
+        for object_id, obj in self.objects.iteritems():
+
+            for cf in self.forearm_cams:
+                obj.remove_frame(cf)
+
     def srv_enable_forearm_cb(self, req):
 
         rospy.loginfo("Enabling forearm cameras.")
@@ -254,15 +669,7 @@ class ArtSimpleTracker:
         rospy.loginfo("Disabling forearm cameras.")
         self.use_forearm_cams = False
 
-        with self.lock:
-            for object_id, obj in self.objects.iteritems():
-
-                for cf in self.forearm_cams:
-
-                    try:
-                        del obj.meas[cf]
-                    except KeyError:
-                        pass
+        self.call(self.remove_forearm_meas)
 
         return EmptyResponse()
 
@@ -278,119 +685,242 @@ class ArtSimpleTracker:
         rospy.loginfo("Disabling object detection.")
         self.detection_enabled = False
 
-        with self.lock:
-            for object_id, obj in self.objects.iteritems():
+        self.call(self.remove_forearm_meas)
 
-                for cf in self.forearm_cams:
+        return EmptyResponse()
 
-                    try:
-                        del obj.meas[cf]
-                    except KeyError:
-                        pass
+    def clear_all_flags(self):
 
-        return EmptyResponse()
+        for k, v in self.objects.iteritems():
+
+            v.flags = {}
 
     def srv_clear_all_flags_cb(self, req):
 
-        with self.lock:
+        self.call(self.clear_all_flags)
+
+        return EmptyResponse()
 
-            for k, v in self.objects.iteritems():
+    def clear_flag(self, req):
 
-                v.flags = {}
+        resp = ObjectFlagClearResponse()
 
-        return EmptyResponse()
+        if req.object_id not in self.objects:
 
-    def srv_clear_flag_cb(self, req):
+            resp.success = False
+            resp.error = "Unknown object"
+            return resp
 
-        with self.lock:
+        if req.key not in self.objects[req.object_id].flags:
 
-            resp = ObjectFlagClearResponse()
+            resp.success = False
+            resp.error = "Unknown key"
+            return resp
+
+        del self.objects[req.object_id].flags[req.key]
+        resp.success = True
+        return resp
 
-            if req.object_id not in self.objects:
+    def srv_clear_flag_cb(self, req):
 
-                resp.success = False
-                resp.error = "Unknown object"
-                return resp
+        return self.call(lambda: self.clear_flag(req))
 
-            if req.key not in self.objects[req.object_id].flags:
+    def set_flag(self, req):
 
-                resp.success = False
-                resp.error = "Unknown key"
-                return resp
+        # TODO should flag be remembered even if object is lost and then detected again?
+        resp = ObjectFlagSetResponse()
 
-            del self.objects[req.object_id].flags[req.key]
-            resp.success = True
+        if req.object_id not in self.objects:
+
+            resp.success = False
+            resp.error = "Unknown object"
             return resp
 
+        self.objects[req.object_id].flags[req.flag.key] = req.flag.value
+        resp.success = True
+        return resp
+
     def srv_set_flag_cb(self, req):
 
-        with self.lock:
+        return self.call(lambda: self.set_flag(req))
 
-            # TODO should flag be remembered even if object is lost and then detected again?
-            resp = ObjectFlagSetResponse()
+    def prune(self, now):
 
-            if req.object_id not in self.objects:
+        for k, v in self.objects.iteritems():
 
-                resp.success = False
-                resp.error = "Unknown object"
-                return resp
+            v.prune_meas(now, self.meas_max_age)
 
-            self.objects[req.object_id].flags[req.flag.key] = req.flag.value
-            resp.success = True
-            return resp
+        # associated objects which were never published and are not seen anymore (e.g. spurious detections)
+        # or which were not confirmed in time
+        if self.associate:
+            for k in [k for k, v in self.objects.iteritems()
+                      if (v.new and v.kf is None) or (v.tentative and now - v.created > self.confirm_period)]:
+                del self.objects[k]
 
-    def prune_timer_cb(self, event):
+    def make_snapshot(self, now):
 
-        with self.lock:
+        ia = InstancesArray()
+        ia.header.frame_id = self.target_frame
+        ia.header.stamp = now
 
-            now = rospy.Time.now()
+        objects_to_delete = []
+
+        for k, v in self.objects.iteritems():
+
+            inst = v.inst(self.table_size, self.ground_objects_on_table, self.ground_bb_axis,
+                          self.yaw_only_on_table)
+
+            if inst is None:  # new object might not have enough measurements yet
+
+                # TODO fix it: this would keep objects which were detected only few times
+                if not v.new and not v.lost:  # object is no longer detected
+
+                    v.lost = True
+                    objects_to_delete.append(k)
+                    ia.lost_objects.append(k)
+                    continue
+
+                continue
+
+            if v.new:
+                v.new = False
+                ia.new_objects.append(k)
+
+            ia.instances.append(inst)
+
+        # commented out in order to keep object flags even if object is lost for some time
+        # for obj_id in objects_to_delete:
+        #    del self.objects[obj_id]
 
-            for k, v in self.objects.iteritems():
+        # ...but ids of associated objects are not stable, so lost objects would only pile up
+        if self.associate:
+            for obj_id in objects_to_delete:
+                del self.objects[obj_id]
 
-                v.prune_meas(now, self.meas_max_age)
+        return ia
+
+    def changed_objects(self, ia, prev):
+        """Returns ids of objects from ia which differ from prev (object_id -> ObjInstance) beyond thresholds."""
+
+        changed = set()
+
+        for inst in ia.instances:
+
+            p = prev.get(inst.object_id)
+
+            if p is None or p.flags != inst.flags or p.on_table != inst.on_table:
+                changed.add(inst.object_id)
+                continue
+
+            a = inst.pose.position
+            b = p.pose.position
+
+            if ((a.x - b.x) ** 2 + (a.y - b.y) ** 2 + (a.z - b.z) ** 2) ** 0.5 > self.change_position_threshold:
+                changed.add(inst.object_id)
+                continue
+
+            # angle between orientations
+            dot = abs(np.dot(q2a(inst.pose.orientation), q2a(p.pose.orientation)))
+
+            if 2.0 * acos(min(dot, 1.0)) > self.change_angle_threshold:
+                changed.add(inst.object_id)
+
+        return changed
 
     def timer_cb(self, event):
 
-        with self.lock:
+        ia = self.snapshot
 
-            ia = InstancesArray()
-            ia.header.frame_id = self.target_frame
-            ia.header.stamp = rospy.Time.now()
+        if ia is None:
+            return
 
-            objects_to_delete = []
+        fresh = ia is not self.consumed
+        self.consumed = ia
 
-            for k, v in self.objects.iteritems():
+        now = rospy.Time.now()
+        keepalive = self.published is None or now - self.published.header.stamp >= self.keepalive_period
 
-                inst = v.inst(self.table_size, self.ground_objects_on_table, self.ground_bb_axis,
-                              self.yaw_only_on_table)
+        if fresh:
+            self.publish_delta(ia)
 
-                if inst is None:  # new object might not have enough measurements yet
+        changed = set()
 
-                    # TODO fix it: this would keep objects which were detected only few times
-                    if not v.new and not v.lost:  # object is no longer detected
+        if fresh and self.publish_on_change:
+            changed = self.changed_objects(ia, {inst.object_id: inst for inst in self.published.instances}
+                                           if self.published is not None else {})
 
-                        v.lost = True
-                        objects_to_delete.append(k)
-                        ia.lost_objects.append(k)
-                        continue
+        if self.publish_on_change and not keepalive and not changed and \
+                not ia.new_objects and not ia.lost_objects and \
+                len(ia.instances) == len(self.published.instances):
+            return
 
-                    continue
+        if not fresh:
 
-                if v.new:
-                    v.new = False
-                    ia.new_objects.append(k)
+            # worker did not make a new snapshot yet, new / lost objects were already announced
+            ia = copy(ia)
+            ia.header = copy(ia.header)
+            ia.header.stamp = now
+            ia.new_objects = []
+            ia.lost_objects = []
 
-                ia.instances.append(inst)
+        self.published = ia
 
-                self.br.sendTransform((inst.pose.position.x, inst.pose.position.y, inst.pose.position.z),
-                                      q2a(inst.pose.orientation), ia.header.stamp, "object_id_" + inst.object_id,
-                                      self.target_frame)
+        for inst in ia.instances:
 
-            # commented out in order to keep object flags even if object is lost for some time
-            # for obj_id in objects_to_delete:
-            #    del self.objects[obj_id]
+            # in change mode, only transforms of changed objects are sent (all of them on keepalive)
+            if self.publish_on_change and not keepalive and inst.object_id not in changed:
+                continue
+
+            self.br.sendTransform((inst.pose.position.x, inst.pose.position.y, inst.pose.position.z),
+                                  q2a(inst.pose.orientation), ia.header.stamp, "object_id_" + inst.object_id,
+                                  self.target_frame)
+
+        self.pub.publish(ia)
 
-            self.pub.publish(ia)
+    def publish_delta(self, ia):
+
+        changed = self.changed_objects(ia, self.delta_state)
+        current = set(inst.object_id for inst in ia.instances)
+        lost = [object_id for object_id in self.delta_state if object_id not in current]
+
+        if not changed and not lost:
+            return
+
+        delta = InstancesDelta()
+        delta.header = ia.header
+        delta.seq = self.delta_seq + 1
+
+        for inst in ia.instances:
+
+            if inst.object_id not in changed:
+                continue
+
+            delta.instances.append(inst)
+
+            if inst.object_id not in self.delta_state:
+                delta.new_objects.append(inst.object_id)
+
+            self.delta_state[inst.object_id] = inst
+
+        for object_id in lost:
+            del self.delta_state[object_id]
+
+        delta.lost_objects = lost
+
+        self.delta_seq = delta.seq
+        self.delta_snapshot = (self.delta_seq, list(self.delta_state.values()))
+        self.delta_pub.publish(delta)
+
+    def srv_get_instances_cb(self, req):
+
+        seq, instances = self.delta_snapshot
+
+        resp = GetInstancesResponse()
+        resp.seq = seq
+        resp.instances.header.frame_id = self.target_frame
+        resp.instances.header.stamp = rospy.Time.now()
+        resp.instances.instances = instances
+        return resp
 
     def cb(self, msg):
 
@@ -403,30 +933,123 @@ class ArtSimpleTracker:
             rospy.logwarn_throttle(1.0, "Some detections are already in target frame!")
             return
 
-        with self.lock:
+        if not msg.instances:
+            return
 
-            for inst in msg.instances:
+        self.queue.append(msg)
+        self.wake.set()
 
-                if inst.object_id in self.objects:
+    def process(self, msg):
 
-                    rospy.logdebug("Updating object: " + inst.object_id)
+        # one transform for the whole frame
+        try:
 
-                else:
+            self.tfl.waitForTransform(self.target_frame, msg.header.frame_id, msg.header.stamp, rospy.Duration(0.5))
+            trans, rot = self.tfl.lookupTransform(self.target_frame, msg.header.frame_id, msg.header.stamp)
+
+        except tf.Exception as e:
+
+            rospy.logwarn("Transform at " + str(msg.header.stamp.to_sec()) + " between " + self.target_frame +
+                          " and " + msg.header.frame_id + " not available: " + str(e))
+            return
+
+        dist, pos, rpy = transform_instances(trans, rot, msg.instances)
+
+        if self.associate:
+
+            self.process_associated(msg, dist, pos, rpy)
+            return
+
+        # types of all new objects are fetched at once
+        object_types = self.object_types.get(
+            [inst.object_type for inst in msg.instances if inst.object_id not in self.objects])
+
+        for idx, inst in enumerate(msg.instances):
+
+            if inst.object_id in self.objects:
+
+                rospy.logdebug("Updating object: " + inst.object_id)
+
+            else:
+
+                object_type = object_types.get(inst.object_type)
+
+                if not object_type:
+                    continue
+
+                rospy.loginfo("Adding new object: " + inst.object_id)
+                self.objects[inst.object_id] = self.create_object(inst.object_id, object_type)
+
+            self.objects[inst.object_id].add_meas(msg.header.frame_id, msg.header.stamp, dist[idx], pos[idx],
+                                                  rpy[idx])
+
+    def create_object(self, object_id, object_type):
+
+        if self.mode == "kalman":
+            return KalmanTrackedObject(object_id, object_type, self.kalman_accel_noise, self.kalman_meas_noise,
+                                       self.kalman_orientation_alpha)
+
+        return TrackedObject(object_id, object_type)
+
+    def process_associated(self, msg, dist, pos, rpy):
+
+        object_types = self.object_types.get([inst.object_type for inst in msg.instances])
+        matched = set()
+
+        for idx, inst in enumerate(msg.instances):
+
+            object_type = object_types.get(inst.object_type)
+
+            if not object_type:
+                continue
+
+            best_id = None
+            best_key = (True, self.association_gate)
+            near = False
+
+            # nearest (not yet matched) object of the same type within the gate, confirmed objects are preferred
+            # so that tentative ones can't steal their detections
+            for object_id, obj in self.objects.iteritems():
+
+                if obj.object_type.name != inst.object_type:
+                    continue
+
+                obj.predict_to(msg.header.stamp)
+                d = obj.distance_sq(dist[idx], pos[idx])
+
+                if d >= self.association_gate:
+                    continue
+
+                near = True
+
+                if object_id not in matched and (obj.tentative, d) < best_key:
+                    best_id = object_id
+                    best_key = (obj.tentative, d)
+
+            if best_id is None:
+
+                # e.g. the same object detected twice in one frame - no new object next to an existing one
+                if near:
+                    continue
+
+                best_id = inst.object_type + "_" + str(self.next_object_id)
+                self.next_object_id += 1
+
+                rospy.logdebug("Adding new tentative object: " + best_id)
+                obj = self.create_object(best_id, object_type)
+                obj.tentative = True
+                obj.created = msg.header.stamp
+                self.objects[best_id] = obj
 
-                    object_type = self.api.get_object_type(inst.object_type)
+            matched.add(best_id)
 
-                    if not object_type:
-                        rospy.logerr("Unknown object type: " + inst.object_type)
-                        continue
+            obj = self.objects[best_id]
+            obj.add_meas(msg.header.frame_id, msg.header.stamp, dist[idx], pos[idx], rpy[idx])
 
-                    rospy.loginfo("Adding new object: " + inst.object_id)
-                    self.objects[inst.object_id] = TrackedObject(self.target_frame, self.tfl, inst.object_id,
-                                                                 object_type)
+            if obj.tentative and obj.updates >= self.confirm_hits:
 
-                ps = PoseStamped()
-                ps.header = msg.header
-                ps.pose = inst.pose
-                self.objects[inst.object_id].add_meas(ps)
+                rospy.loginfo("Adding new object: " + best_id)
+                obj.tentative = False
 
 
 if __name__ == '__main__':
@@ -7,6 +7,7 @@ import rospy
 from geometry_msgs.msg import PoseStamped
 import tf
 from art_msgs.msg import InstancesArray
+from art_simple_tracker.srv import GetInstances
 from art_utils import ArtApiHelper
 from art_utils.art_msgs_functions import obj_type
 
@@ -49,6 +50,15 @@ class TestSimpleTrackerRos(unittest.TestCase):
         self.assertEquals(len(msg.instances), 1, "test_topic_inst_len")
         self.assertEquals(msg.instances[0].object_id, self.object_id, "test_topic_inst_object_id")
 
+    def test_delta(self):
+
+        rospy.wait_for_service('/art/object_detector/object_filtered/get', 1.0)
+        resp = rospy.ServiceProxy('/art/object_detector/object_filtered/get', GetInstances)()
+
+        self.assertGreater(resp.seq, 0, "test_delta_seq")
+        self.assertEquals(len(resp.instances.instances), 1, "test_delta_inst_len")
+        self.assertEquals(resp.instances.instances[0].object_id, self.object_id, "test_delta_inst_object_id")
+
 
 if __name__ == '__main__':
 